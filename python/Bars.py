@@ -0,0 +1,100 @@
+"""
+Bars resamples a tick series into open/high/low/close bars per timeframe
+
+Each timeframe is built from the finest cached timeframe that divides it (1s, 1min, 5min, 1h, 1D),
+only the finest one is built from the ticks, bucket edges come from one diff over the bar numbers
+Bars.of shares one cache per series so switching the timeframe of a chart is a lookup
+"""
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+
+from pure_tech.core.Logger import Logger
+logger = Logger(__file__)
+
+# timeframes a coarser one is built from, finest first
+LEVELS = ['1s', '1min', '5min', '1h', '1D']
+
+## Timeframe as ns, pandas style strings ('1s','1min','5min','1h','1D') or a Timedelta
+def tfNs(tf):
+    ns = pd.Timedelta(tf).value
+    if ns <= 0:
+        raise Exception( f"Invalid timeframe {tf}" )
+    return ns
+
+LEVEL_NS = [tfNs(l) for l in LEVELS]
+
+## Address of the data behind a Series or array, used with the length to recognise a series again
+def _buffer(a):
+    v = a.values if isinstance(a, (pd.Series, pd.Index)) else a
+    v = getattr(v, '_ndarray', v)
+    return v.__array_interface__['data'][0] if isinstance(v, np.ndarray) else id(a)
+
+## Group sorted bar numbers b into bars, o/h/l/c are the finer values (all the ticks for a first level)
+def _merge(b, o, h, l, c, n):
+    if len(b) == 0:
+        return b, o, h, l, c, n
+    starts = np.concatenate( [[0], np.flatnonzero(np.diff(b)) + 1] )
+    ends = np.concatenate( [starts[1:], [len(b)]] )
+    return (b[starts], o[starts], np.maximum.reduceat(h, starts), np.minimum.reduceat(l, starts), c[ends-1],
+            np.add.reduceat(n, starts))
+
+class Bars:
+    cache = OrderedDict()
+    cacheSize = 64
+
+    ## x datetimes and y prices of the ticks, NaT and NaN ticks are dropped, x is only sorted when it is not already
+    def __init__(self, x, y):
+        di = pd.DatetimeIndex(x)
+        if di.tz is not None:
+            # bars follow the wall clock, days start at local midnight
+            di = di.tz_localize(None)
+        xn = (di.as_unit('ns') if hasattr(di, 'as_unit') else di).asi8
+        yv = np.asarray(y, dtype=np.float64)
+        ok = ~di.isna() & np.isfinite(yv)
+        if not ok.all():
+            xn, yv = xn[ok], yv[ok]
+        if len(xn) > 1 and (np.diff(xn) < 0).any():
+            o = np.argsort(xn, kind='stable')
+            xn, yv = xn[o], yv[o]
+        self.x = xn
+        self.y = yv
+        self.levels = {}
+
+    ## Shared Bars for series x,y, the least recently used ones are dropped past cacheSize
+    ## Series are matched on their data buffers, call clear after changing the values of one in place
+    def of(x, y):
+        key = (_buffer(x), _buffer(y), len(y))
+        br = Bars.cache.get(key)
+        if br is None:
+            br = Bars(x, y)
+            # the series are kept so their buffers are not reused while the key is cached
+            Bars.cache[key] = (br, x, y)
+            while len(Bars.cache) > Bars.cacheSize:
+                Bars.cache.popitem(last=False)
+        else:
+            Bars.cache.move_to_end(key)
+            br = br[0]
+        return br
+
+    def clear():
+        Bars.cache.clear()
+
+    ## Bars of timeframe tf as a dict of x (bar start) open high low close and count (ticks) arrays
+    def get(self, tf):
+        ns = tfNs(tf)
+        if ns not in self.levels:
+            finer = [f for f in LEVEL_NS if f < ns and ns % f == 0]
+            if len(finer) > 0:
+                src = self.get(finer[-1])
+                b = src['x'].view('i8') // ns
+                b, o, h, l, c, n = _merge(b, src['open'], src['high'], src['low'], src['close'], src['count'])
+            else:
+                b = self.x // ns
+                b, o, h, l, c, n = _merge(b, self.y, self.y, self.y, self.y, np.ones(len(b), dtype=np.int64))
+            self.levels[ns] = {'x':(b*ns).view('datetime64[ns]'), 'open':o, 'high':h, 'low':l, 'close':c, 'count':n}
+            logger.info( f"Built {len(b)} bars of {tf} from {len(self.x)} ticks" )
+        return self.levels[ns]
+
+    def timeframes(self):
+        return [pd.Timedelta(ns) for ns in sorted(self.levels)]
@@ -7,8 +7,29 @@ addTrace add a layer on chart with series and plots
 call final to assemble the charts
 to check multiple y series or y1 series and switch types where required easily
 Build save images and plot to notebooks
+Large series can be downsampled (lttb or minmax) to a point budget per trace, set with maxPoints
+Live data can be streamed into the traces of a final chart with append, see setStream
+encode/toJSON keep trace data as binary buffers (base64 typed arrays in json) instead of number lists
+traces with the same x share one buffer in toJSON and in html files written by save, json files stay standard plotly
+unless saved with shared=True
+Images can be exported in the background on a long lived process pool with saveAsync and saveMany
+Rendered images can be reused from a disk cache keyed on the figure, see setRenderCache
+plot also takes pyarrow Tables, polars frames and parquet/feather paths, only the x and matching y columns are read
+Candle and OHLC types resample tick columns into bars of the chart timeframe, setTimeframe switches from cached bars
+Intraday gaps on datetime x axes can be hidden with rangebreaks, final(props={'sessions':True}) instead of a category axis
+y patterns match a part of a column name, '^name' matches the start and 're:expr' a regex, all ignoring case
+'expr:bid - ask' plots a derived series, see Expr, evaluated on the columns and reused across refreshes
+filter shows a subset of rows of a plotted frame in place, used by GUI.linkCharts with CrossFilter indexes
 """
 import random
+import threading
+import time
+import json
+import base64
+import re
+import bisect
+from collections import OrderedDict
+from contextlib import nullcontext
 from plotly.subplots import make_subplots
 import plotly.graph_objects as go
 import pandas as pd
@@ -16,6 +37,9 @@ import numpy as np
 
 from datetime import datetime, date, timedelta
 from pure_tech.core.Logger import Logger
+from pure_tech.core.RingBuffer import RingBuffer
+from pure_tech.core.Bars import Bars
+from pure_tech.core.Expr import Expr
 logger = Logger(__file__)
 
 from enum import Enum, auto
@@ -27,6 +51,8 @@ class ChartTypes(Enum):
     Dots = auto()
     Column = auto()
     Bar = auto()
+    Candle = auto()
+    OHLC = auto()
 
     def all():
         return [i[1].name for i in ChartTypes.__members__.items()]
@@ -37,31 +63,602 @@ class ChartTypes(Enum):
                 return e[1]
         return defVal
 
+## Convert a vector (numbers or datetimes) to float64 for bucket maths
+def _numeric(a):
+    if isinstance(a, (pd.Series, pd.Index)) and pd.api.types.is_datetime64_any_dtype(a):
+        di = pd.DatetimeIndex(a)
+        return (di.as_unit('ns') if hasattr(di, 'as_unit') else di).asi8.astype(np.float64)
+    v = np.asarray(a)
+    if np.issubdtype(v.dtype, np.datetime64):
+        return v.astype('datetime64[ns]').view('i8').astype(np.float64)
+    if np.issubdtype(v.dtype, np.timedelta64):
+        return v.astype('timedelta64[ns]').view('i8').astype(np.float64)
+    return v.astype(np.float64, copy=False)
+
+## Per bucket arg max of vals over [starts,ends), buckets padded into one 2d block
+def _bucketArgMax(vals, starts, ends):
+    cnt = ends - starts
+    idx = starts[:,None] + np.arange(cnt.max())[None,:]
+    pad = idx >= ends[:,None]
+    blk = vals[np.minimum(idx, len(vals)-1)]
+    blk[pad] = -np.inf
+    return starts + np.argmax(blk, axis=1)
+
+## Always keep first, last and the true min/max points of y
+def _withExtremes(idx, y):
+    ext = [0, len(y)-1]
+    if np.isfinite(y).any():
+        ext += [np.nanargmin(y), np.nanargmax(y)]
+    return np.unique(np.concatenate([idx, np.asarray(ext, dtype=np.int64)]))
+
+## Indexes of min and max point per bucket, about n points in total
+def minMaxIndex(y, n):
+    yv = _numeric(y)
+    ln = len(yv)
+    if ln <= n or n < 4:
+        return np.arange(ln)
+    edges = np.linspace(0, ln, n//2+1).astype(np.int64)
+    starts, ends = edges[:-1], edges[1:]
+    nan = np.isnan(yv)
+    mx = _bucketArgMax(np.where(nan, -np.inf, yv), starts, ends)
+    mn = _bucketArgMax(np.where(nan, -np.inf, -yv), starts, ends)
+    return _withExtremes(np.concatenate([mn, mx]), yv)
+
+## Largest triangle three buckets, vectorized by using the previous bucket average as the left anchor
+def lttbIndex(x, y, n):
+    xv, yv = _numeric(x), _numeric(y)
+    ln = len(yv)
+    if ln <= n or n < 3:
+        return np.arange(ln)
+    edges = np.linspace(1, ln-1, n-1).astype(np.int64)
+    starts, ends = edges[:-1], edges[1:]
+    cnt = ends - starts
+    fin = np.isfinite(yv)
+    yf = np.where(fin, yv, 0.0)
+    mx = np.add.reduceat(xv[:ln-1], starts) / cnt
+    my = np.add.reduceat(yf[:ln-1], starts) / np.maximum(np.add.reduceat(fin[:ln-1].astype(np.int64), starts), 1)
+    ax = np.concatenate([[xv[0]], mx[:-1]])
+    ay = np.concatenate([[yf[0]], my[:-1]])
+    cx = np.concatenate([mx[1:], [xv[-1]]])
+    cy = np.concatenate([my[1:], [yf[-1]]])
+    bid = np.repeat(np.arange(len(cnt)), cnt)
+    px, py = xv[1:ln-1], yv[1:ln-1]
+    area = np.abs( (ax[bid]-cx[bid])*(py-ay[bid]) - (ax[bid]-px)*(cy[bid]-ay[bid]) )
+    area = np.where(np.isfinite(area), area, -1.0)
+    sel = _bucketArgMax(area, starts-1, ends-1) + 1
+    return _withExtremes(sel, yv)
+
+DAY_NS = 86400 * 10**9
+MINUTE_NS = 60 * 10**9
+WEEKDAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+
+## Datetimes as int64 ns of wall clock time without NaT, tz aware values keep the local time plotly shows
+def _wallNs(x):
+    if not isinstance(x, (pd.Series, pd.Index)):
+        x = pd.Index(np.asarray(x))
+    di = pd.DatetimeIndex(x)
+    if di.tz is not None:
+        di = di.tz_localize(None)
+    di = di.as_unit('ns') if hasattr(di, 'as_unit') else di
+    return di.asi8[~di.isna()]
+
+## Rangebreaks hiding the gaps in datetime x longer than minGap (10 median steps by default)
+## A close to open time repeating across gaps becomes one hour pattern, never traded weekdays a day pattern,
+## the other gaps get their own bounds, the largest maxBreaks of them. x is only sorted when it is not already
+def sessionBreaks(x, minGap=None, maxBreaks=500):
+    v = _wallNs(x)
+    if len(v) < 3:
+        return []
+    d = np.diff(v)
+    if (d < 0).any():
+        v = np.sort(v)
+        d = np.diff(v)
+    pos = d[d > 0]
+    if len(pos) == 0:
+        return []
+    step = int(np.median(pos))
+    at = np.nonzero( d > (pd.Timedelta(minGap).value if minGap is not None else 10*step) )[0]
+    if len(at) == 0:
+        return []
+    # a gap runs from the end of the bar before it to the next bar
+    g0, g1 = v[at] + step, v[at+1]
+    brks = []
+    present = np.zeros(7, dtype=bool)
+    present[ np.unique( (v//DAY_NS + 3) % 7 ) ] = True
+    dayBreaks = v[-1]-v[0] >= 7*DAY_NS and not present.all()
+    if dayBreaks:
+        for s in range(7):
+            if not present[s] and present[(s-1) % 7]:
+                e = s
+                while not present[e % 7]:
+                    e += 1
+                brks.append( {'bounds':[WEEKDAYS[s], WEEKDAYS[e % 7]]} )
+    explained = np.zeros(len(at), dtype=bool)
+    pair = ((g0 % DAY_NS)//MINUTE_NS)*1440 + (g1 % DAY_NS)//MINUTE_NS
+    vals, cnt = np.unique(pair, return_counts=True)
+    top = vals[cnt.argmax()]
+    c0, c1 = top//1440, top % 1440
+    if cnt.max() >= 2 and c0 != c1:
+        d0, d1 = g0//DAY_NS, g1//DAY_NS
+        if c0 < c1:
+            explained = (pair == top) & (d0 == d1)
+        else:
+            # wraps midnight, whole days skipped in between must be hidden by the day pattern
+            skipped = np.busday_count( (d0+1).astype('datetime64[D]'), d1.astype('datetime64[D]'), weekmask=present ) if dayBreaks else d1-d0-1
+            explained = (pair == top) & (d1 > d0) & (skipped == 0)
+        brks.append( {'pattern':'hour', 'bounds':[int(c0)/60, int(c1)/60]} )
+    rest = np.nonzero(~explained)[0]
+    if len(rest) > maxBreaks:
+        rest = np.sort( rest[ np.argsort(g1[rest]-g0[rest])[-maxBreaks:] ] )
+    brks += [ {'bounds':[pd.Timestamp(g0[i]), pd.Timestamp(g1[i])]} for i in rest ]
+    return brks
+
+## Streamed x values as float64 or datetime64[ns] arrays
+def _streamArray(v):
+    a = np.atleast_1d(np.asarray(v))
+    if a.dtype.kind in 'OUSM':
+        a = pd.to_datetime(a).values.astype('datetime64[ns]')
+    return a
+
+# trace keys holding data columns, encoded as binary buffers
+ARRAY_KEYS = ['x', 'y', 'open', 'high', 'low', 'close']
+# plotly.js typed array codes, it has no 64 bit integers
+TYPED_ARRAYS = {'float64':'f8', 'float32':'f4', 'int32':'i4', 'uint32':'u4', 'int16':'i2', 'uint16':'u2',
+                'int8':'i1', 'uint8':'u1'}
+
+## Contiguous NumPy buffer for a trace column, datetimes become epoch ms, returns (array, isDate)
+def _encodeArray(v, float32=False):
+    a = np.asarray(v)
+    if a.dtype.kind == 'O' and len(a) > 0 and pd.api.types.infer_dtype(a, skipna=True) in ('datetime', 'datetime64', 'date'):
+        a = pd.to_datetime(a).values
+    if a.dtype.kind == 'M':
+        ms = a.astype('datetime64[ms]')
+        out = ms.astype(np.int64).astype(np.float64)
+        out[np.isnat(ms)] = np.nan
+        return out, True
+    if a.dtype.kind == 'f':
+        return np.ascontiguousarray(a, dtype=np.float32 if float32 else np.float64), False
+    if a.dtype.kind in 'iub':
+        return np.ascontiguousarray(a), False
+    return v, False
+
+## Replace NumPy buffers with plotly.js typed array specs {dtype, bdata}
+def _typedArrays(o):
+    if isinstance(o, dict):
+        return {k:_typedArrays(v) for k, v in o.items()}
+    if isinstance(o, (list, tuple)):
+        return [_typedArrays(v) for v in o]
+    if isinstance(o, np.ndarray) and o.dtype.kind in 'iufb' and o.ndim == 1:
+        if o.dtype.name not in TYPED_ARRAYS:
+            fits = o.dtype.kind in 'iu' and (len(o) == 0 or (o.min() >= -2**31 and o.max() < 2**31))
+            o = o.astype(np.int32 if fits else np.float64)
+        return {'dtype':TYPED_ARRAYS[o.dtype.name], 'bdata':base64.b64encode(np.ascontiguousarray(o)).decode('ascii')}
+    return o
+
+## Move trace columns used by more than one trace into fd['buffers'], traces point at them with {'ref': i}
+def _shareBuffers(fd):
+    seen, uses = {}, []
+    for tr in fd['data']:
+        for k in ARRAY_KEYS:
+            a = tr.get(k)
+            if not isinstance(a, np.ndarray) or a.ndim != 1 or len(a) == 0:
+                continue
+            key = (a.dtype.str, len(a), a[:1].tobytes(), a[-1:].tobytes())
+            for ref in seen.setdefault(key, []):
+                if np.array_equal(uses[ref][0], a, equal_nan=a.dtype.kind=='f'):
+                    uses[ref][1].append( (tr, k) )
+                    break
+            else:
+                seen[key].append(len(uses))
+                uses.append( (a, [(tr, k)]) )
+    fd['buffers'] = []
+    for a, at in uses:
+        if len(at) > 1:
+            for tr, k in at:
+                tr[k] = {'ref':len(fd['buffers'])}
+            fd['buffers'].append(a)
+    return fd
+
+# standalone page for save html, resolves shared buffers once into typed arrays before plotting
+HTML_PAGE = """<html><head><meta charset="utf-8"/><script type="text/javascript">{plotly}</script></head>
+<body><div id="chart" style="width:100%;height:100%"></div><script type="text/javascript">
+var fig = {fig};
+var T = {{f8:Float64Array,f4:Float32Array,i4:Int32Array,u4:Uint32Array,i2:Int16Array,u2:Uint16Array,i1:Int8Array,u1:Uint8Array}};
+var bufs = (fig.buffers || []).map(function(b) {{
+    var s = atob(b.bdata), u = new Uint8Array(s.length);
+    for (var i = 0; i < s.length; i++) u[i] = s.charCodeAt(i);
+    return new T[b.dtype](u.buffer);
+}});
+fig.data.forEach(function(t) {{
+    for (var k in t) if (t[k] && t[k].ref !== undefined) t[k] = bufs[t[k].ref];
+}});
+Plotly.newPlot('chart', fig.data, fig.layout);
+</script></body></html>
+"""
+
+# long lived pool of image export processes, started on first saveAsync/saveMany
+_exportPool = None
+
+## Start one long lived kaleido server per worker, exports in that worker reuse its browser instead of
+## starting one per image. The server is stopped when the worker exits on closeExportPool
+def _exportInit():
+    try:
+        import kaleido
+        if hasattr(kaleido, 'start_sync_server'):
+            from multiprocessing.util import Finalize
+            kaleido.start_sync_server(silence_warnings=True)
+            # atexit does not run in pool workers, multiprocessing finalizers do
+            Finalize(None, kaleido.stop_sync_server, kwargs={'silence_warnings':True}, exitpriority=10)
+        else:
+            # kaleido before 1.0 keeps its engine alive after the first image
+            import plotly.io as pio
+            pio.to_image(go.Figure(), format='png')
+    except Exception as e:
+        logger.info( f"Export worker warm up failed {e}" )
+
+## Render one figure dict to an image file in a worker
+def _exportImage(fd, fn):
+    import plotly.io as pio
+    pio.write_image(fd, fn)
+    return fn
+
+## Process pool used for image exports, local processes only
+def exportPool(workers=None):
+    global _exportPool
+    if _exportPool is None:
+        from concurrent.futures import ProcessPoolExecutor
+        _exportPool = ProcessPoolExecutor(max_workers=workers, initializer=_exportInit)
+    return _exportPool
+
+## Stop the export workers, the next export starts a new pool
+def closeExportPool(wait=True):
+    global _exportPool
+    if _exportPool is not None:
+        _exportPool.shutdown(wait=wait)
+        _exportPool = None
+
+# file suffixes read as feather (arrow ipc), anything else is read as parquet (file or partitioned directory)
+FEATHER_SUFFIXES = ('.feather', '.arrow', '.ipc')
+
+## Lowercase index over the column names of one schema, pattern lookups are cached on it
+## Part and prefix patterns are found with one regex pass over the joined names
+class ColumnIndex:
+    cache = OrderedDict()
+    cacheSize = 32
+    last = None
+
+    def __init__(self, cols):
+        self.cols = list(cols)
+        names = [str(c).lower().replace('\n', ' ') for c in self.cols]
+        self.joined = '\n'.join(names)
+        self.starts = []
+        pos = 0
+        for nm in names:
+            self.starts.append(pos)
+            pos += len(nm) + 1
+        self.found = {}
+
+    ## Shared index for a schema, the least recently used ones are dropped past cacheSize
+    ## A frame hands out the same columns Index each time, which skips building the key again
+    def of(cols):
+        if ColumnIndex.last is not None and ColumnIndex.last[0] is cols:
+            return ColumnIndex.last[1]
+        key = tuple(cols)
+        ci = ColumnIndex.cache.get(key)
+        if ci is None:
+            ci = ColumnIndex(key)
+            ColumnIndex.cache[key] = ci
+            while len(ColumnIndex.cache) > ColumnIndex.cacheSize:
+                ColumnIndex.cache.popitem(last=False)
+        else:
+            ColumnIndex.cache.move_to_end(key)
+        if isinstance(cols, pd.Index):
+            # pandas Index is immutable, a list could change under the same object
+            ColumnIndex.last = (cols, ci)
+        return ci
+
+    ## Positions of the columns matching pattern pat, in column order
+    def match(self, pat):
+        idx = self.found.get(pat)
+        if idx is None:
+            if pat.startswith('re:'):
+                rx = re.compile(pat[3:], re.IGNORECASE)
+                idx = [i for i, c in enumerate(self.cols) if rx.search(str(c))]
+            else:
+                body = re.escape(pat[1:].lower()) if pat.startswith('^') else '[^\n]*' + re.escape(pat.lower())
+                rx = re.compile('^' + body, re.MULTILINE)
+                idx = [bisect.bisect_right(self.starts, m.start()) - 1 for m in rx.finditer(self.joined)]
+            self.found[pat] = idx
+        return idx
+
+    ## Columns matching any of pats, in column order
+    def find(self, pats):
+        hit = set()
+        for p in pats:
+            hit.update(self.match(p))
+        return [self.cols[i] for i in sorted(hit)]
+
+## Columns of y patterns, matching as plot does
+def matchColumns(cols, pats):
+    return ColumnIndex.of(cols).find(pats)
+
+## Column names of a pandas/polars frame, pyarrow Table or parquet/feather path, files only have their schema read
+def frameColumns(src):
+    if isinstance(src, pd.DataFrame):
+        return list(src.columns)
+    if isinstance(src, str):
+        if src.lower().endswith(FEATHER_SUFFIXES):
+            import pyarrow as pa
+            return pa.ipc.open_file(pa.memory_map(src)).schema.names
+        import pyarrow.dataset as ds
+        return ds.dataset(src, format='parquet').schema.names
+    if type(src).__module__.startswith('polars') and hasattr(src, 'collect_schema'):
+        return src.collect_schema().names()
+    if hasattr(src, 'column_names'):
+        return list(src.column_names)
+    raise Exception( f"Unsupported chart data source {type(src)}" )
+
+## Arrow column as a Series, single chunk primitive columns without nulls share the arrow buffer
+def _arrowSeries(col, name):
+    import pyarrow as pa
+    t = col.type
+    if col.null_count == 0 and (pa.types.is_integer(t) or pa.types.is_floating(t) or
+                                (pa.types.is_timestamp(t) and t.tz is None)):
+        arr = col.combine_chunks() if col.num_chunks != 1 else col.chunk(0)
+        return pd.Series(arr.to_numpy(zero_copy_only=False), name=name, copy=False)
+    return pd.Series(col.to_pandas(), name=name)
+
+## Read only cols of src into a pandas DataFrame, files are memory mapped and pandas frames are returned as is
+def loadColumns(src, cols):
+    if isinstance(src, pd.DataFrame):
+        return src
+    cols = list(dict.fromkeys(cols))
+    if isinstance(src, str):
+        if src.lower().endswith(FEATHER_SUFFIXES):
+            import pyarrow.feather as feather
+            tbl = feather.read_table(src, columns=cols, memory_map=True)
+        else:
+            import pyarrow.parquet as pq
+            tbl = pq.read_table(src, columns=cols, memory_map=True)
+    elif type(src).__module__.startswith('polars'):
+        sel = src.select(cols)
+        tbl = (sel.collect() if hasattr(sel, 'collect') else sel).to_arrow()
+    elif hasattr(src, 'column_names'):
+        tbl = src.select(cols)
+    else:
+        raise Exception( f"Unsupported chart data source {type(src)}" )
+    return pd.DataFrame( {c: _arrowSeries(tbl.column(c), c) for c in cols}, copy=False )
+
+DOWNSAMPLERS = {'lttb': lttbIndex, 'minmax': lambda x, y, n: minMaxIndex(y, n)}
+
 ## Chart class to load and plot charts
 ## Ability bind and load multiple sub plots
 ## Load from and plot from dataframes
 class Chart:
 
-    def __init__(self, log=False):
+    # assemble figures with one add_traces and one layout update instead of a call per trace and axis
+    batched = True
+    # RenderCache shared by all charts for image saves, None renders every time
+    renderCache = None
+    # tables longer than this are paged, only one page of rows goes into the figure
+    tablePage = 1000
+
+    def __init__(self, log=False, maxPoints=None, downsample='minmax', glThreshold=50000):
         self.shouldLog = log
         self.traces = {}
         self.cols = 0
         self.specs = {}
         self.fig = None
         self.titles = {}
+        self.sources = {}
+        self.fullData = []
+        self.resampler = None
+        self.dirty = set()
+        self.placed = {}
+        self.built = None
+        self.glThreshold = glThreshold
+        self.index = {}
+        # id of each trace -> its position in fig.data, a column can have several traces in one cell
+        self.tracePos = {}
+        self.fw = None
+        self.fwSynced = False
+        self.streams = {}
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.timer = None
+        self.lastFlush = 0.0
+        self.float32 = False
+        self.pages = {}
+        self.breaks = None
+        self.timeframe = '1min'
+        # per trace id, like sources
+        self.bars = {}
+        self.origins = {}
+        self.rangeListeners = []
+        self.setDownsample(maxPoints, downsample)
+        self.setStream()
 
     def log(self,x,force=False):
         if self.shouldLog or force:
             logger.info( f"{datetime.now().strftime('%Y%m%d %H:%M:%S.%f')} {x}" )
 
+    ## Set point budget per trace used by plot, None disables downsampling
+    ## method is lttb or minmax, both keep the true extremes of the series
+    def setDownsample(self, maxPoints, method='minmax'):
+        if method not in DOWNSAMPLERS:
+            raise Exception( f"Unknown downsample method {method} expected one of {list(DOWNSAMPLERS.keys())}" )
+        self.maxPoints = maxPoints
+        self.downsample = method
+
+    ## Reduce x and y to the point budget before the trace is built
+    def reduce(self, x, y):
+        if self.maxPoints is None or len(y) <= self.maxPoints:
+            return x, y
+        idx = DOWNSAMPLERS[self.downsample](x, y, self.maxPoints)
+        self.log( f"Downsampled {getattr(y,'name','')} {len(y)} -> {len(idx)} using {self.downsample}" )
+        x = x.iloc[idx] if isinstance(x, pd.Series) else np.asarray(x)[idx]
+        y = y.iloc[idx] if isinstance(y, pd.Series) else np.asarray(y)[idx]
+        return x, y
+
+    ## Window kept per streamed trace, last maxPoints points and if set only the last seconds of x
+    ## fps caps how often appends are pushed to the figure
+    def setStream(self, maxPoints=10000, seconds=None, fps=20):
+        self.streamPoints = maxPoints
+        self.streamSecs = seconds
+        self.frame = 1.0/fps
+
+    ## Ring buffers for trace i seeded with what the trace shows now
+    def _seed(self, i, xDtype):
+        src = self.fullData[i] if self.fullData[i] is not None else (self.fig.data[i].x, self.fig.data[i].y)
+        xb = RingBuffer(self.streamPoints, 'datetime64[ns]' if xDtype.kind=='M' else np.float64)
+        yb = RingBuffer(self.streamPoints)
+        if src[0] is not None and len(src[0]) > 0:
+            xb.extend(_streamArray(src[0])[-self.streamPoints:])
+            yb.extend(np.asarray(src[1], dtype=np.float64)[-self.streamPoints:])
+        return xb, yb
+
+    ## Stream points into an existing trace of the final chart, pushed to the figure at most fps times a second
+    def append(self, row, col, name, x, y):
+        if (row,col,name) not in self.index:
+            raise Exception( f"No trace {name} in chart cell {row},{col}, call final before append" )
+        key = (row,col,name)
+        x, y = _streamArray(x), np.atleast_1d(np.asarray(y, dtype=np.float64))
+        with self.lock:
+            if key not in self.streams:
+                self.streams[key] = self._seed(self.index[key], x.dtype)
+                if self.resampler is not None:
+                    self.resampler.drop(self.index[key])
+            xb, yb = self.streams[key]
+            xb.extend(x)
+            yb.extend(y)
+            if self.streamSecs is not None:
+                xs = xb.view()
+                span = np.timedelta64(int(self.streamSecs*1e9), 'ns') if xs.dtype.kind=='M' else self.streamSecs
+                n = int(np.searchsorted(xs, xs[-1]-span, 'left'))
+                xb.drop(n)
+                yb.drop(n)
+            self.pending.add(key)
+        now = time.monotonic()
+        if now - self.lastFlush >= self.frame:
+            self.flush()
+        elif self.timer is None:
+            self.timer = threading.Timer(self.frame - (now - self.lastFlush), self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    ## Push all pending streamed points to the displayed widget or the figure in one batch_update
+    def flush(self):
+        with self.lock:
+            self.timer = None
+            self.lastFlush = time.monotonic()
+            pending, self.pending = self.pending, set()
+            fig = self.fw if self.fw is not None and self.fwSynced else self.fig
+            if len(pending) == 0 or fig is None:
+                return
+            with fig.batch_update():
+                for key in pending:
+                    xb, yb = self.streams[key]
+                    fig.data[self.index[key]].x = xb.view()
+                    fig.data[self.index[key]].y = yb.view()
+
+    ## Downcast float columns to float32 when encoding for widgets and json
+    def setEncoding(self, float32=False):
+        self.float32 = float32
+
+    ## Final figure as a dict with data columns as contiguous NumPy buffers
+    ## datetime columns become epoch ms on date axes so no column is sent as a list of strings
+    def encode(self, float32=None):
+        float32 = self.float32 if float32 is None else float32
+        # to_dict may already base64 encode arrays, so take the raw buffers from the traces
+        fd = {'data':[t.to_plotly_json() for t in self.fig.data], 'layout':self.fig.layout.to_plotly_json()}
+        lay = fd['layout']
+        for tr in fd['data']:
+            for k in ARRAY_KEYS:
+                if k not in tr or tr[k] is None or isinstance(tr[k], dict):
+                    continue
+                ax = ('xaxis' if k=='x' else 'yaxis') + tr.get('xaxis' if k=='x' else 'yaxis', k)[1:]
+                a, isDate = _encodeArray(tr[k], float32)
+                if isDate:
+                    # keep dates as they are on category axes
+                    if lay.get(ax, {}).get('type', 'date') not in ['date', '-']:
+                        continue
+                    lay.setdefault(ax, {})['type'] = 'date'
+                tr[k] = a
+        return fd
+
+    ## Final figure as json with base64 typed arrays instead of number lists
+    ## with shared, columns used by several traces (usually x) are stored once in buffers and referenced by index
+    def toJSON(self, float32=None, shared=True):
+        from plotly.utils import PlotlyJSONEncoder
+        fd = self.encode(float32)
+        if shared:
+            fd = _shareBuffers(fd)
+        # PlotlyJSONEncoder.encode re-parses its output, only its default is needed once arrays are base64
+        return json.dumps(_typedArrays(fd), default=PlotlyJSONEncoder().default)
+
     ## Set title for chart or Sub chart block
     def setTitle(self, r, c, title, xT = None, y1T = None, y2T = None ):
         self.titles[(r,c)] = {'title':title, 'xt':xT, 'y1':y1T, 'y2':y2T}
+        self.dirty.add( (r,c) )
+
+    ## Cache rendered images under path up to maxBytes, path None switches the cache off
+    def setRenderCache(path, maxBytes=512*1024*1024):
+        from pure_tech.core.RenderCache import RenderCache
+        Chart.renderCache = RenderCache(path, maxBytes) if path is not None else None
+        return Chart.renderCache
+
+    ## Render cache key of the final figure for an image type, None when there is no cache
+    def _renderKey(self, fType):
+        if Chart.renderCache is None:
+            return None
+        return Chart.renderCache.key(self.toJSON(shared=False), fType)
 
-    ## Save chart to file
-    def save(self,fName,fType='jpeg'):
+    ## Save chart in the background, images render on the export pool, returns a future with the file name
+    def saveAsync(self,fName,fType='jpeg',shared=False):
+        from concurrent.futures import Future
+        if self.fig is None:
+            raise Exception( f"Chart has no figure to save to {fName}, call final first" )
+        fn = f"{fName}.{fType}" if fType not in fName else fName
+        if fType not in ['json', 'html']:
+            key = self._renderKey(fType)
+            if key is None or not Chart.renderCache.get(key, fn):
+                ft = exportPool().submit(_exportImage, self.fig.to_dict(), fn)
+                if key is not None:
+                    cache = Chart.renderCache
+                    ft.add_done_callback(lambda f: cache.put(key, fn) if f.exception() is None else None)
+                return ft
+        else:
+            self.save(fName, fType, shared=shared)
+        ft = Future()
+        ft.set_result(fn)
+        return ft
+
+    ## Save several charts in parallel on the export pool, waits for all and returns the file names
+    def saveMany(charts, fNames, fType='jpeg'):
+        fts = [ch.saveAsync(fn, fType) for ch, fn in zip(charts, fNames)]
+        return [ft.result() for ft in fts]
+
+    ## Save chart to file, html keeps shared x buffers and decodes them itself, other types are rendered images
+    ## json is standard plotly figure json, shared=True writes the smaller shared buffer format only HTML_PAGE reads
+    def save(self,fName,fType='jpeg',shared=False):
         if self.fig is not None:
-            self.fig.write_image( f"{fName}.{fType}" if fType not in fName else fName )
+            fn = f"{fName}.{fType}" if fType not in fName else fName
+            if fType == 'json' and not shared:
+                self.fig.write_json( fn )
+            elif fType == 'json':
+                with open(fn, 'w') as f:
+                    f.write( self.toJSON() )
+            elif fType == 'html':
+                from plotly.offline import get_plotlyjs
+                with open(fn, 'w') as f:
+                    f.write( HTML_PAGE.format(plotly=get_plotlyjs(), fig=self.toJSON()) )
+            else:
+                key = self._renderKey(fType)
+                if key is not None and Chart.renderCache.get(key, fn):
+                    return
+                self.fig.write_image( fn )
+                if key is not None:
+                    Chart.renderCache.put(key, fn)
 
     ## Add a single plot for x and y and bind
     def addPlot(tp, x, y, name, color=None, showLegend=True, mode=None, legendGroup = None, width=2, symbol=None):
@@ -87,42 +684,202 @@ class Chart:
             return go.Scatter( x=x, y=y, name=name, mode='lines', connectgaps=True, legendgroup=legendGroup,
                         line_color=color, showlegend=showLegend)
 
+    ## Convert an svg Scatter trace to a WebGL Scattergl trace keeping the resolved styling
+    def toGL(tr):
+        if type(tr) != go.Scatter:
+            return tr
+        return go.Scattergl( {k:v for k,v in tr.to_plotly_json().items() if k!='type'} )
+
+    ## WebGL is used for a subplot when forced by props gl or when its points go above the threshold
+    ## never with sessions, plotly.js hides scattergl traces on axes with rangebreaks
+    def useGL(self, trs, props=None):
+        props = props if props is not None else {}
+        if 'sessions' in props and props['sessions']:
+            if 'gl' in props and props['gl']:
+                self.log( "gl is ignored with sessions, scattergl traces do not render on axes with rangebreaks" )
+            return False
+        if 'gl' in props and props['gl'] is not None:
+            return props['gl']
+        thr = props['glThreshold'] if 'glThreshold' in props else self.glThreshold
+        if thr is None:
+            return False
+        return sum( [len(t[0].x) for t in trs if type(t[0])==go.Scatter and t[0].x is not None] ) > thr
+
     ## Plot columns from dataframe, by adding several chart points across
+    ## df can be a pandas/polars frame, a pyarrow Table or a parquet/feather path, see loadColumns
+    ## styles caches the resolved style per (column, pattern, axis) across calls, the caller drops it when the
+    ## types or colors change
     def plot(self, df, x, y1s, y2s=[], y1Type={}, y2Type={}, colors={}, showLegend=True, row=1, col=1, 
-            xT=None, y1T=None, y2T=None, title=None, legendGroup=None):
+            xT=None, y1T=None, y2T=None, title=None, legendGroup=None, styles=None):
         y1s = [y1s] if isinstance(y1s,list)==False else y1s
         y2s = [y2s] if isinstance(y2s,list)==False else y2s
-        for y1 in y1s:
-            for ln in df.columns:
-                if y1.lower() in ln.lower():
-                    self.intAddPlot( df[x], df[ln], ln, y1, y1Type, colors, False, row, col, showLegend, legendGroup=legendGroup )
-        
-        for ln in df.columns:
-            for y2 in y2s:
-                if y2.lower() in ln.lower():
-                    self.intAddPlot( df[x], df[ln], ln, y2, y2Type, colors, True, row, col, showLegend, legendGroup=legendGroup )
+        exprs = {y: Expr.of(y[5:]) for y in y1s + y2s if y.startswith('expr:')}
+        pats = [y for y in y1s + y2s if y not in exprs]
+        if not isinstance(df, pd.DataFrame):
+            # resolve the patterns on the schema so only x and the plotted columns are read
+            cols = frameColumns(df)
+            ecs = [c for ex in exprs.values() for c in ex.columns(cols)]
+            df = loadColumns(df, [x] + [c for c in matchColumns(cols, pats) + ecs if c != x])
+        ci = ColumnIndex.of(df.columns)
+        # y1s are plotted pattern by pattern, y2s column by column then expressions, expressions have no column index
+        y1m = [m for y1 in y1s for m in ([(None, y1)] if y1 in exprs else [(i, y1) for i in ci.match(y1)])]
+        y2m = [(i, y2s[j]) for i, j in sorted([(i, j) for j, y2 in enumerate(y2s) if y2 not in exprs for i in ci.match(y2)])]
+        y2m += [(None, y2) for y2 in y2s if y2 in exprs]
+        styles = styles if styles is not None else {}
+        for (i, s1), dct, secondY in [(m, y1Type, False) for m in y1m] + [(m, y2Type, True) for m in y2m]:
+            ln = ci.cols[i] if i is not None else exprs[s1].text
+            if (ln, s1, secondY) not in styles:
+                styles[(ln, s1, secondY)] = Chart.style(ln, s1, dct, colors)
+            y = df[ln] if i is not None else exprs[s1].eval(df)
+            self.intAddPlot( df[x], y, ln, s1, dct, colors, secondY, row, col, showLegend, legendGroup=legendGroup,
+                             style=styles[(ln, s1, secondY)] )
+            # frame and columns of the trace so filter can cut it again
+            tr = self.traces[row][col][-1][0]
+            self.origins[id(tr)] = (row, col, df, x, exprs[s1] if i is None else ln, tr)
         if title is not None:
             self.setTitle( row, col, title, xT, y1T, y2T )
 
     ## Plot a dataframe as a tablewith columns and values  in chart
-    def plotTable(self, dfe, row=1, col=1, title=None, fmts=None):
+    ## Tables longer than pageSize (Chart.tablePage by default) only get one page of rows, move with page
+    def plotTable(self, dfe, row=1, col=1, title=None, fmts=None, pageSize=None):
         headerColor = 'grey'
         rowEvenColor = 'lightgrey'
         rowOddColor = 'white'
+        pageSize = pageSize if pageSize is not None else (Chart.tablePage if len(dfe) > Chart.tablePage else None)
+        rows = dfe if pageSize is None else dfe.iloc[0:pageSize]
         tr = go.Table(
             header=dict(values=dfe.columns,line_color='darkslategray',fill_color=headerColor,align=['left','center'],
-            font=dict(color='white', size=12)),cells=dict(values=[dfe[c] for c in dfe.columns],line_color='darkslategray',
+            font=dict(color='white', size=12)),cells=dict(values=[rows[c] for c in rows.columns],line_color='darkslategray',
             format=fmts, fill_color = [[rowOddColor,rowEvenColor,rowOddColor, rowEvenColor,rowOddColor]*5],
             align = ['left', 'center'],font = dict(color = 'darkslategray', size = 11)) )
+        if pageSize is not None:
+            self.pages[(row,col)] = {'df':dfe, 'size':pageSize, 'page':0, 'trace':tr}
         self.addTrace(tr, 'table', row, col, False)
 
-    ## Internal function to attach plot
-    def intAddPlot( self, x, y, ln, s1, dct, colors, secondY, row, col, showLegend, legendGroup=None ):
+    ## Number of pages of the paged table in a chart cell
+    def pageCount(self, row, col):
+        pg = self.pages[(row,col)]
+        return max( (len(pg['df'])+pg['size']-1)//pg['size'], 1 )
+
+    ## Show page p of the paged table in a chart cell, only those rows are sliced and sent
+    def page(self, row, col, p):
+        if (row,col) not in self.pages:
+            raise Exception( f"No paged table in chart cell {row},{col}" )
+        pg = self.pages[(row,col)]
+        pg['page'] = max( min(p, self.pageCount(row,col)-1), 0 )
+        s = pg['page']*pg['size']
+        rows = pg['df'].iloc[s:s+pg['size']]
+        vals = [rows[c] for c in rows.columns]
+        pg['trace'].cells.values = vals
+        i = self.index.get( (row,col,None) )
+        for fig in self._figs(i, 'table'):
+            fig.data[i].cells.values = vals
+        return pg['page']
+
+    ## Chart type list and color for column ln matched by pattern s1
+    def style(ln, s1, dct, colors):
         s1t = dct[s1] if s1 in dct else ['Scatter']
         s1t = s1t if type(s1t)==list else [s1t]
         clr = colors[ln] if ln in colors else None
         if clr is not None:
             clr = colors[s1] if s1 in colors else None
+        return s1t, clr
+
+    ## Candlestick or OHLC trace of bars b from Bars.get
+    def addBars(tp, b, name, showLegend=True, legendGroup=None):
+        if type(tp)==str:
+            tp = ChartTypes.toEnum(tp)
+        cls = go.Candlestick if tp==ChartTypes.Candle else go.Ohlc
+        return cls( x=b['x'], open=b['open'], high=b['high'], low=b['low'], close=b['close'], name=name,
+                    legendgroup=legendGroup, showlegend=showLegend )
+
+    ## Bar traces show tf bars from now on, existing ones are swapped from the Bars cache in the chart and its widget
+    def setTimeframe(self, tf, row=None, col=None):
+        self.timeframe = tf
+        n = 0
+        for r, c, br, tr in self.bars.values():
+            if (row is not None and r != row) or (col is not None and c != col):
+                continue
+            b = br.get(tf)
+            vals = {k:b[k] for k in ['x','open','high','low','close']}
+            tr.update(vals)
+            i = self.tracePos.get( id(tr) )
+            for fig in self._figs(i, tr.type):
+                fig.data[i].update(vals)
+            n += 1
+        return n
+
+    ## Show only rows (a slice or positions) of frame df in the traces plotted from it, in the chart and its widget
+    ## Traces are downsampled or resampled into bars again, other traces are not touched
+    def filter(self, df, rows):
+        n = 0
+        live = self.fw is not None and self.fwSynced
+        with (self.fw.batch_update() if live else nullcontext()):
+            for r, c, src, x, y, tr in self.origins.values():
+                if src is not df:
+                    continue
+                xs = df[x].iloc[rows]
+                ys = (y.eval(df) if isinstance(y, Expr) else df[y]).iloc[rows]
+                if id(tr) in self.bars:
+                    br = Bars.of(xs, ys)
+                    self.bars[id(tr)] = (r, c, br, tr)
+                    b = br.get(self.timeframe)
+                    vals = {k:b[k] for k in ['x','open','high','low','close']}
+                else:
+                    rx, ry = self.reduce(xs, ys)
+                    vals = {'x':rx, 'y':ry}
+                    if ry is not ys:
+                        self.sources[id(tr)] = (xs, ys)
+                    else:
+                        self.sources.pop(id(tr), None)
+                tr.update(vals)
+                i = self.tracePos.get( id(tr) )
+                if i is not None:
+                    for fig in self._figs(i, tr.type):
+                        fig.data[i].update(vals)
+                    self.fullData[i] = self.sources.get(id(tr))
+                    if self.resampler is not None and live:
+                        if self.fullData[i] is not None:
+                            self.resampler.source(i, xs, ys)
+                        else:
+                            self.resampler.drop(i)
+                n += 1
+        if live and self.resampler is None and any(s is not None for s in self.fullData):
+            self._attach(self.fw)
+        self.log( f"Filtered {n} traces to {len(range(df.shape[0])[rows]) if isinstance(rows, slice) else len(rows)} rows" )
+        return n
+
+    ## Call fn(range) when the x range of the chart widget changes, range is None on autorange
+    def onRange(self, fn):
+        self.rangeListeners.append(fn)
+        if self.fw is not None:
+            self._listen(self.fw)
+
+    ## One range callback per x axis of widget fw, on_change replaces the previous one so this can run on every attach
+    ## and the resampler goes through it too
+    def _listen(self, fw):
+        for ax in [a.plotly_name for a in fw.select_xaxes()]:
+            fw.layout[ax].on_change(lambda o, rng, auto, ax=ax: self._onRange(ax, None if auto else rng), 'range', 'autorange')
+
+    def _onRange(self, ax, rng):
+        if self.resampler is not None and self.resampler.fw is self.fw:
+            self.resampler.update(ax, rng)
+        for fn in self.rangeListeners:
+            fn(rng)
+
+    ## Internal function to attach plot
+    def intAddPlot( self, x, y, ln, s1, dct, colors, secondY, row, col, showLegend, legendGroup=None, style=None ):
+        s1t, clr = Chart.style(ln, s1, dct, colors) if style is None else style
+        tp = ChartTypes.toEnum(s1t[0]) if type(s1t[0])==str else s1t[0]
+        if tp in [ChartTypes.Candle, ChartTypes.OHLC]:
+            # bars are already a reduction, the ticks are resampled instead of downsampled
+            br = Bars.of(x, y)
+            tr = Chart.addBars( tp, br.get(self.timeframe), ln, showLegend=showLegend, legendGroup=legendGroup )
+            self.bars[id(tr)] = (row, col, br, tr)
+            self.addTrace( tr, 'xy', row, col, secondY )
+            return
+        fx, fy = x, y
+        x, y = self.reduce(x, y)
         tr = None
         if len(s1t) >= 4:
             clr = clr if clr is not None else s1t[3]
@@ -130,6 +887,9 @@ class Chart:
                               symbol=s1t[2], width=s1t[4], mode=s1t[1], legendGroup=legendGroup )
         else:
             tr = Chart.addPlot( s1t[0], x, y, ln, color=clr, showLegend=showLegend, legendGroup=legendGroup )
+        if fy is not y:
+            # keep full resolution source so widgets can resample on zoom
+            self.sources[id(tr)] = (fx, fy)
         self.addTrace( tr, 'xy', row, col, secondY )
         
     ## Add a sub plot
@@ -139,23 +899,203 @@ class Chart:
         if c not in self.traces[r]:
             self.traces[r][c] = []
         self.traces[r][c].append( (tr,secondY) )
+        self.dirty.add( (r,c) )
         self.cols = max( self.cols, c )
         if (r,c) not in self.specs:
             self.specs[(r,c)] = [trt,secondY]
         elif not self.specs[(r,c)][1] and secondY:
             self.specs[(r,c)][1] = True
 
+    ## Figures trace i of type tp can be changed in place in, the widget only while it shows the last final
+    ## a final since then may have moved the traces, the next syncWidget brings it up to date
+    def _figs(self, i, tp):
+        figs = [self.fig] + ([self.fw] if self.fwSynced else [])
+        return [f for f in figs if f is not None and i is not None and i < len(f.data) and f.data[i].type in [tp, tp+'gl']]
+
+    ## Bind a displayed FigureWidget to this chart, downsampled traces get resampled on zoom
+    def _attach(self, fw):
+        self.fw = fw
+        self.fwSynced = True
+        self.resampler = None
+        if any(s is not None for s in self.fullData):
+            from pure_tech.core.Resampler import Resampler
+            self.resampler = Resampler(fw, self.fullData, method=self.downsample, listen=False)
+        self._listen(fw)
+        return fw
+
+    ## Build a FigureWidget from the final figure
+    def widget(self):
+        return self._attach( go.FigureWidget(self.encode()) )
+
+    ## Update a displayed FigureWidget in place to the final figure, plotly only sends the values that changed
+    ## returns False when the subplot axes differ and a new widget is needed
+    def syncWidget(self, fw):
+        axes = lambda f: [a.plotly_name for a in f.select_xaxes()] + [a.plotly_name for a in f.select_yaxes()]
+        if self.fig is None or axes(fw) != axes(self.fig):
+            return False
+        fd = self.encode()
+        new = fd['data']
+        keep = 0
+        while keep < min(len(fw.data), len(new)) and fw.data[keep].type == new[keep].get('type', 'scatter'):
+            keep += 1
+        if keep < len(fw.data):
+            fw.data = fw.data[:keep]
+        with fw.batch_update():
+            for i in range(keep):
+                fw.data[i].update({k:v for k, v in new[i].items() if k!='type'}, overwrite=True)
+            # layout keys the previous chart set and this one does not are cleared first, update alone would keep them
+            gone = [k for k in fw.layout.to_plotly_json() if k not in fd['layout']]
+            fw.plotly_relayout({k:None for k in gone})
+            fw.layout.update(fd['layout'], overwrite=True)
+        if keep < len(new):
+            fw.add_traces(new[keep:])
+        self.log( f"Synced widget kept {keep} traces added {len(new)-keep}" )
+        self._attach(fw)
+        return True
+
+    ## Forget a widget that is being closed
+    def detach(self, fw):
+        if self.fw is fw:
+            self.fw = None
+            self.resampler = None
+
     ## Show/Display chart
     def show(self, mode=None, handle=None):
         if self.fig is not None:
             if mode is None:
                 self.fig.show()
             elif mode=='widget' and handle is None:
-                go.FigureWidget(self.fig.to_dict()).show()
+                from IPython.display import display
+                display(self.widget())
             elif mode=='widget':
                 handle.update(self.fig)
     
+    ## Traces not yet on fig in cell order, cells switching renderer are re-added
+    ## returns the traces to add and the order of fig.data with None where a new trace goes
+    def _place(self, fig, props):
+        old = list(fig.data)
+        pos, order, trs = 0, [], []
+        self.fullData = []
+        self.index = {}
+        self.tracePos = {}
+        for r in range(1,len(self.traces)+1):
+            st=self.traces[r]
+            self.log( f"Plot: Ploting Row:{r}" )
+            for c in range(1,len(st)+1):
+                n0, gl0 = self.placed.get((r,c), (0, None))
+                gl = self.useGL(st[c], props)
+                keep = n0 if gl == gl0 else 0
+                order.extend( old[pos:pos+keep] )
+                pos += n0
+                for t in st[c][keep:]:
+                    trs.append( (Chart.toGL(t[0]) if gl else t[0], r, c, t[1]) )
+                    order.append( None )
+                for t in st[c]:
+                    self.index[(r,c,t[0].name)] = len(self.fullData)
+                    self.tracePos[id(t[0])] = len(self.fullData)
+                    self.fullData.append( self.sources.get(id(t[0])) )
+                self.placed[(r,c)] = (len(st[c]), gl)
+        return trs, order
+
+    ## Add all traces in one add_traces call
+    def _addTraces(self, fig, trs):
+        if len(trs) > 0:
+            fig.add_traces( [t[0] for t in trs], rows=[t[1] for t in trs], cols=[t[2] for t in trs],
+                           secondary_ys=[t[3] for t in trs] )
+
+    ## Axis titles of the given cells into the layout dict lay
+    def _titles(self, fig, cells, lay):
+        axis = lambda a: lay.setdefault(a.plotly_name, {})
+        for r, c, sy in cells:
+            if self.specs[(r,c)][0] != 'xy':
+                continue
+            stt = self.titles[(r,c)]
+            sp = fig.get_subplot(r, c)
+            axis(sp.xaxis)['title'] = {'text':stt['xt']}
+            axis(sp.yaxis)['title'] = {'text':stt['y1']}
+            if sy:
+                sp = fig.get_subplot(r, c, secondary_y=True)
+                # the y1 title set on the whole cell leaves an empty title behind when y2 is None
+                axis(sp.yaxis)['title'] = {'text':stt['y2']} if stt['y2'] is not None or stt['y1'] is None else go.layout.yaxis.Title()
+        return lay
+
+    ## Add all traces and set all axis titles, ranges and angles in one layout update
+    def _assemble(self, fig, trs, cells, xAngle, yAngle, y1Range, y2Range):
+        self._addTraces(fig, trs)
+        lay = {}
+        axis = lambda a: lay.setdefault(a.plotly_name, {})
+        if xAngle is not None:
+            for a in fig.select_xaxes():
+                axis(a)['tickangle'] = xAngle
+        if yAngle is not None:
+            for a in fig.select_yaxes():
+                axis(a)['tickangle'] = yAngle
+        if y1Range is not None:
+            for a in fig.select_yaxes():
+                axis(a)['range'] = y1Range
+        self._titles(fig, cells, lay)
+        # per cell updates overwrite the y1Range on secondary axes only when the last cell has one
+        if y2Range is not None and (cells[-1][2] if y1Range is not None else any(sy for r, c, sy in cells)):
+            for a in fig.select_yaxes(secondary_y=True):
+                axis(a)['range'] = y2Range
+        if len(lay) > 0:
+            fig.update_layout(lay)
+
+    ## Add traces and axis settings one call at a time, kept to compare against _assemble
+    def _assembleEach(self, fig, trs, cells, xAngle, yAngle, y1Range, y2Range):
+        for t in trs:
+            fig.add_trace( t[0], row=t[1], col=t[2], secondary_y=t[3] )
+        for r, c, sy in cells:
+            stt = self.titles[(r,c)]
+            fig.update_xaxes( title_text=stt['xt'], row=r, col=c )
+            if xAngle is not None:
+                fig.update_xaxes( tickangle=xAngle )
+            if yAngle is not None:
+                fig.update_yaxes( tickangle=yAngle )
+                if sy:
+                    fig.update_yaxes( tickangle=yAngle, secondary_y=True )
+            fig.update_yaxes( title_text=stt['y1'], row=r, col=c )
+            if y1Range is not None:
+                fig.update_yaxes(range=y1Range)
+            if sy:
+                fig.update_yaxes( title_text=stt['y2'], row=r, col=c, secondary_y=True )
+                if y2Range is not None:
+                    fig.update_yaxes(range=y2Range, secondary_y=True)
+
+    ## Patch the existing figure with traces and titles changed since the last final
+    def _patch(self, fig, titls, cells, props):
+        trs, order = self._place(fig, props)
+        self._addTraces(fig, trs)
+        new = iter(fig.data[len(fig.data)-len(trs):])
+        order = [t if t is not None else next(new) for t in order]
+        if len(order) != len(fig.data) or any(a is not b for a, b in zip(order, fig.data)):
+            fig.data = order
+        dirty = [cl for cl in cells if (cl[0],cl[1]) in self.dirty]
+        lay = self._titles(fig, dirty, {})
+        if len(lay) > 0:
+            fig.update_layout(lay)
+        # subplot titles are annotations in cell order, empty titles have none
+        ann = [(cl, t) for cl, t in zip(cells, titls) if t]
+        for k, (cl, t) in enumerate(ann):
+            if (cl[0],cl[1]) in self.dirty and fig.layout.annotations[k].text != t:
+                fig.layout.annotations[k].text = t
+        self.log( f"Patched {len(trs)} traces, {len(dirty)} cells" )
+
+    ## Hide session gaps on the x axes with rangebreaks from the longest datetime x, only updated when they change
+    def _sessions(self, fig, minGap):
+        xs = [ self.fullData[i][0] if i < len(self.fullData) and self.fullData[i] is not None else tr.x
+               for i, tr in enumerate(fig.data) if tr.type != 'table' and tr.x is not None ]
+        xs = sorted( [x for x in xs if len(x) > 0], key=len, reverse=True )
+        x = xs[0] if len(xs) > 0 else None
+        brks = []
+        if x is not None and pd.api.types.is_datetime64_any_dtype( x if isinstance(x, (pd.Series, pd.Index)) else pd.Index(np.asarray(x)) ):
+            brks = sessionBreaks(x, minGap)
+        if brks != self.breaks or fig is not self.fig:
+            fig.update_xaxes(rangebreaks=brks)
+            self.breaks = brks
+
     ## Assemble and plot charts
+    ## When the grid, specs and axis settings are unchanged since the last final only the changes are patched into self.fig
     def final(self,title=None,w=None,h=None,xAngle=None,yAngle=None,y1Range=None,y2Range=None,sharedX=True,sharedY=True,props=None):
         if len(self.traces) <=0:
             self.log( "No Chart available" )
@@ -164,6 +1104,7 @@ class Chart:
         self.log( f"num Traces:{len(self.traces)} traces:{len(self.traces[1])}, cols:{self.cols}" )
         self.log( self.specs )
         titls = []
+        cells = []
         for r in range(1,len(self.traces)+1):
             st=self.traces[r]
             spcs.append( [ 
@@ -174,37 +1115,28 @@ class Chart:
                 if (r,c) not in self.titles:
                     self.titles[(r,c)] = stt
                 titls.append( stt['title'] )
+                cells.append( (r, c, self.specs[(r,c)][1]) )
         self.log( spcs )
-        vspace = 0.06 if len(self.traces)<10 else 0.01
-        hspace = 0.08 if self.cols<10 else 0.01
-        fig =  make_subplots( rows=len(self.traces), cols=self.cols, vertical_spacing=vspace, horizontal_spacing=hspace,
-                             specs=spcs, subplot_titles=titls, shared_xaxes=sharedX, shared_yaxes=sharedY)
-        for r in range(1,len(self.traces)+1):
-            st=self.traces[r]
-            self.log( f"Plot: Ploting Row:{r}" )
-            for c in range(1,len(st)+1):
-                sy = self.specs[(r,c)][1]
-                lt=1
-                for t in st[c]:
-                    #self.log( "Plot:", r, c, lt, t, sy )
-                    fig.add_trace( t[0], row=r, col=c , secondary_y=t[1] )
-                    lt=lt+1
-                stt = self.titles[(r,c)]
-                #fig.update_layout( title_text=stt['title'], row=r, col=c )
-                fig.update_xaxes( title_text=stt['xt'], row=r, col=c )
-                if xAngle is not None:
-                    fig.update_xaxes( tickangle=xAngle )
-                if yAngle is not None:
-                    fig.update_yaxes( tickangle=yAngle )
-                    if sy:
-                        fig.update_yaxes( tickangle=yAngle, secondary_y=True )
-                fig.update_yaxes( title_text=stt['y1'], row=r, col=c )
-                if y1Range is not None:
-                    fig.update_yaxes(range=y1Range)
-                if sy:
-                    fig.update_yaxes( title_text=stt['y2'], row=r, col=c, secondary_y=True )
-                    if y2Range is not None:
-                        fig.update_yaxes(range=y2Range, secondary_y=True)
+        # make_subplots fills defaults into spcs, so compare against a copy, title and size are only ever set, a rebuild drops them
+        built = ([[dict(sp) for sp in rw] for rw in spcs], [bool(t) for t in titls], sharedX, sharedY, xAngle, yAngle, y1Range, y2Range,
+                 dict(props) if props is not None else None, title, w, h)
+        if self.fig is not None and self.built == built:
+            fig = self.fig
+            self._patch(fig, titls, cells, props)
+        else:
+            vspace = 0.06 if len(self.traces)<10 else 0.01
+            hspace = 0.08 if self.cols<10 else 0.01
+            fig =  make_subplots( rows=len(self.traces), cols=self.cols, vertical_spacing=vspace, horizontal_spacing=hspace,
+                                 specs=spcs, subplot_titles=titls, shared_xaxes=sharedX, shared_yaxes=sharedY)
+            self.placed = {}
+            trs, order = self._place(fig, props)
+            if Chart.batched:
+                self._assemble(fig, trs, cells, xAngle, yAngle, y1Range, y2Range)
+            else:
+                self._assembleEach(fig, trs, cells, xAngle, yAngle, y1Range, y2Range)
+        self.built = built
+        self.fwSynced = False
+        self.dirty = set()
         if title is not None:
             fig.update_layout( title_text=title )
         if w is not None and h is not None:
@@ -216,6 +1148,8 @@ class Chart:
         if props is not None:
             if 'cat' in props and props['cat']=='Category':
                 fig.update_layout(xaxis_type='category')
+            if 'sessions' in props and props['sessions']:
+                self._sessions(fig, None if props['sessions'] is True else props['sessions'])
             if 'stack' in props:
                 fig.update_layout(barmode='stack')
             if 'logy' in props and props['logy']:
@@ -232,6 +1166,50 @@ class Chart:
         self.fig = fig
         return self.fig
 
+## Time final with batched and per call assembly on a rows x cols grid, figures must come out identical
+def benchAssemble(rows=6, cols=4, traces=8, n=500, loops=3):
+    import time, json
+    df = pd.DataFrame( {'x':np.arange(n), **{f'y{i}':np.random.randn(n) for i in range(traces)}} )
+    res = {}
+    for batched in [False, True]:
+        Chart.batched = batched
+        tms = []
+        for l in range(loops):
+            g = Chart()
+            for r in range(1,rows+1):
+                for c in range(1,cols+1):
+                    g.plot( df, 'x', [f'y{i}' for i in range(traces-1)], [f'y{traces-1}'], row=r, col=c,
+                           title=f"r:{r}.c:{c}", xT='x', y1T='y1', y2T='y2' )
+            st = time.perf_counter()
+            fig = g.final( "Bench", xAngle=45, yAngle=0, y1Range=[-3,3], y2Range=[-5,5] )
+            tms.append( time.perf_counter()-st )
+        res[batched] = (min(tms), json.loads(fig.to_json()))
+    Chart.batched = True
+    logger.info( f"final {rows}x{cols}x{traces}: per call {res[False][0]:.3f}s batched {res[True][0]:.3f}s "
+                f"speedup {res[False][0]/res[True][0]:.1f}x identical {res[False][1]==res[True][1]}" )
+    return res[False][0], res[True][0]
+
+## Time saving n charts one by one against saveMany on the export pool
+def benchSave(n=20, points=2000, path='.'):
+    import os
+    df = pd.DataFrame( {'x':np.arange(points), **{f'y{i}':np.random.randn(points) for i in range(4)}} )
+    charts = []
+    for i in range(n):
+        g = Chart()
+        g.plot( df, 'x', ['y'], title=f"Chart {i}" )
+        g.final( f"Bench {i}" )
+        charts.append(g)
+    st = time.perf_counter()
+    for i, g in enumerate(charts):
+        g.save( os.path.join(path, f"benchSerial{i}") )
+    serial = time.perf_counter()-st
+    exportPool()
+    st = time.perf_counter()
+    Chart.saveMany( charts, [os.path.join(path, f"benchPool{i}") for i in range(n)] )
+    pooled = time.perf_counter()-st
+    logger.info( f"save {n} charts: serial {serial:.2f}s pool {pooled:.2f}s speedup {serial/pooled:.1f}x" )
+    return serial, pooled
+
 if __name__=='__main__':
     g=Chart()
     opt = 2
@@ -273,7 +1251,8 @@ if __name__=='__main__':
         df=pd.DataFrame.from_dict(dct)
         if useTime:
             df['x']=df['x'].astype('datetime64[ns]')
-            df = df.sort_values(by='x')
+            if not df['x'].is_monotonic_increasing:
+                df = df.sort_values(by='x')
         rw=1
         t=1
         if method==1:
@@ -309,6 +1288,11 @@ if __name__=='__main__':
                 c=['x']+[l for l in df.columns if str(t)+'_' in l]
                 g.plotTable(df[c], row=t, col=cl, title="My table")
                 cl=cl+1
-    fig=g.final( "Test Charts" )
-    g.save( "TestChart.jpeg" )
+    if opt == 3:
+        benchAssemble()
+    elif opt == 4:
+        benchSave()
+    else:
+        fig=g.final( "Test Charts" )
+        g.save( "TestChart.jpeg" )
 
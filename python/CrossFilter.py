@@ -0,0 +1,107 @@
+"""
+CrossFilter resolves selections on the key columns of one frame to the rows charts linked to it show
+
+Indexes are built once per key column, numbers and datetimes get a sorted index searched with a binary search,
+other columns (instruments, sides) a packed bitmap per value, or per value row lists past maxBitmaps values
+A selection on a sorted key column stays a row range, the others are combined with a bitmap AND
+"""
+import numpy as np
+import pandas as pd
+
+from pure_tech.core.Logger import Logger
+logger = Logger(__file__)
+
+class CrossFilter:
+
+    ## df is the frame the linked charts were plotted from, cols the key columns selections are made on
+    def __init__(self, df, cols, maxBitmaps=256):
+        self.df = df
+        self.n = len(df)
+        self.maxBitmaps = maxBitmaps
+        self.sorted = {}
+        self.bitmaps = {}
+        self.postings = {}
+        self.tz = {}
+        for c in cols:
+            self.index(c)
+
+    ## Build the index of key column c
+    def index(self, c):
+        v = self.df[c]
+        if pd.api.types.is_datetime64_any_dtype(v) or pd.api.types.is_numeric_dtype(v):
+            if pd.api.types.is_datetime64_any_dtype(v):
+                di = pd.DatetimeIndex(v)
+                self.tz[c] = di.tz
+                a = (di.as_unit('ns') if hasattr(di, 'as_unit') else di).asi8
+            else:
+                a = v.to_numpy()
+            if len(a) < 2 or (np.diff(a) >= 0).all():
+                # already in order, selections are plain row ranges
+                self.sorted[c] = (a, None)
+            else:
+                o = np.argsort(a, kind='stable')
+                self.sorted[c] = (a[o], o)
+            return
+        codes, uniq = pd.factorize(v)
+        o = np.argsort(codes, kind='stable')
+        cs = codes[o]
+        starts = np.searchsorted(cs, np.arange(len(uniq)), 'left')
+        ends = np.searchsorted(cs, np.arange(len(uniq)), 'right')
+        if len(uniq) <= self.maxBitmaps:
+            bms = {}
+            for k, u in enumerate(uniq):
+                bm = np.zeros(self.n, dtype=bool)
+                bm[o[starts[k]:ends[k]]] = True
+                bms[u] = np.packbits(bm)
+            self.bitmaps[c] = bms
+        else:
+            self.postings[c] = {u: o[starts[k]:ends[k]] for k, u in enumerate(uniq)}
+
+    ## Bound of a range on datetime column c as ns, plotly sends the wall clock time of tz aware axes
+    def _bound(self, c, b):
+        if c not in self.tz:
+            return b
+        ts = pd.Timestamp(b)
+        if self.tz[c] is not None:
+            ts = ts.tz_localize(self.tz[c]) if ts.tz is None else ts.tz_convert(self.tz[c])
+        return ts.value
+
+    ## Packed bitmap of row positions pos
+    def _bits(self, pos):
+        bm = np.zeros(self.n, dtype=bool)
+        bm[pos] = True
+        return np.packbits(bm)
+
+    ## Rows matching all criteria, a (lo,hi) range for sorted columns (either end None for open) or a value or list
+    ## of values for the others. Returns a slice when the rows are one range, row positions otherwise
+    def select(self, **crit):
+        s, e = 0, self.n
+        mask = None
+        for c, want in crit.items():
+            if want is None:
+                continue
+            if c in self.sorted:
+                a, o = self.sorted[c]
+                lo, hi = want
+                i0 = 0 if lo is None else int(np.searchsorted(a, self._bound(c, lo), 'left'))
+                i1 = len(a) if hi is None else int(np.searchsorted(a, self._bound(c, hi), 'right'))
+                if o is None:
+                    s, e = max(s, i0), min(e, i1)
+                    continue
+                bm = self._bits(o[i0:i1])
+            elif c in self.bitmaps or c in self.postings:
+                vals = want if isinstance(want, (list, tuple, set)) else [want]
+                if c in self.bitmaps:
+                    bms = [self.bitmaps[c][v] for v in vals if v in self.bitmaps[c]]
+                    bm = np.bitwise_or.reduce(bms) if len(bms) > 0 else np.zeros((self.n+7)//8, dtype=np.uint8)
+                else:
+                    pos = [self.postings[c][v] for v in vals if v in self.postings[c]]
+                    bm = self._bits( np.concatenate(pos) if len(pos) > 0 else np.zeros(0, dtype=np.int64) )
+            else:
+                raise Exception( f"Column {c} is not indexed" )
+            mask = bm if mask is None else np.bitwise_and(mask, bm)
+        if mask is None:
+            return slice(s, max(s, e))
+        if e <= s:
+            return np.zeros(0, dtype=np.int64)
+        return s + np.flatnonzero( np.unpackbits(mask, count=self.n)[s:e] )
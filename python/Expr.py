@@ -0,0 +1,130 @@
+"""
+Derived series for Chart.plot written as expressions over frame columns, e.g. 'bid - ask' or 'rolling_mean(px, 50)'
+
+Expressions are parsed once into a small tree of arithmetic, numbers, column names and the functions in FUNCS,
+names that are not identifiers go in backticks. Evaluation works on the column arrays, no frame is built,
+and results are memoized on the expression and the data buffers of the columns it reads
+"""
+import ast
+import re
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+
+from pure_tech.core.Bars import _buffer
+from pure_tech.core.Logger import Logger
+logger = Logger(__file__)
+
+## Rolling window statistic of array a over n points
+def _roll(a, n, how):
+    return getattr(pd.Series(a, copy=False).rolling(int(n)), how)().to_numpy()
+
+FUNCS = {
+    'rolling_mean': lambda a, n: _roll(a, n, 'mean'),
+    'rolling_std': lambda a, n: _roll(a, n, 'std'),
+    'rolling_min': lambda a, n: _roll(a, n, 'min'),
+    'rolling_max': lambda a, n: _roll(a, n, 'max'),
+    'ema': lambda a, span: pd.Series(a, copy=False).ewm(span=span, adjust=False).mean().to_numpy(),
+    'diff': lambda a, n=1: pd.Series(a, copy=False).diff(int(n)).to_numpy(),
+    'shift': lambda a, n=1: pd.Series(a, copy=False).shift(int(n)).to_numpy(),
+    'pct_change': lambda a, n=1: pd.Series(a, copy=False).pct_change(int(n)).to_numpy(),
+    'log': np.log,
+    'exp': np.exp,
+    'sqrt': np.sqrt,
+    'abs': np.abs,
+}
+
+OPS = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.true_divide, ast.Pow: np.power,
+       ast.USub: np.negative, ast.UAdd: np.positive}
+
+class Expr:
+    parsed = {}
+    cache = OrderedDict()
+    cacheSize = 64
+
+    def __init__(self, text):
+        self.text = text.strip()
+        quoted = {}
+        def quote(m):
+            quoted[f"_q{len(quoted)}"] = m.group(1)
+            return f"_q{len(quoted)-1}"
+        src = re.sub(r'`([^`]*)`', quote, self.text)
+        try:
+            self.tree = ast.parse(src, mode='eval').body
+        except SyntaxError as e:
+            raise Exception( f"Invalid expression {self.text} {e}" )
+        self.quoted = quoted
+        self.names = []
+        self._check(self.tree)
+
+    ## Compiled expression for text, parsed once
+    def of(text):
+        ex = Expr.parsed.get(text)
+        if ex is None:
+            ex = Expr(text)
+            Expr.parsed[text] = ex
+        return ex
+
+    def clear():
+        Expr.cache.clear()
+
+    ## Reject anything but arithmetic, numbers, names and FUNCS calls, and collect the column names
+    def _check(self, nd):
+        if isinstance(nd, ast.BinOp) and type(nd.op) in OPS:
+            self._check(nd.left)
+            self._check(nd.right)
+        elif isinstance(nd, ast.UnaryOp) and type(nd.op) in OPS:
+            self._check(nd.operand)
+        elif isinstance(nd, ast.Constant) and isinstance(nd.value, (int, float)):
+            pass
+        elif isinstance(nd, ast.Name):
+            nm = self.quoted.get(nd.id, nd.id)
+            if nm not in self.names:
+                self.names.append(nm)
+        elif isinstance(nd, ast.Call) and isinstance(nd.func, ast.Name) and nd.func.id in FUNCS and len(nd.keywords) == 0:
+            for a in nd.args:
+                self._check(a)
+        else:
+            raise Exception( f"Unsupported expression {ast.unparse(nd)} in {self.text}" )
+
+    ## Frame columns the expression reads, names match exactly or else ignoring case
+    def columns(self, cols):
+        res = []
+        for nm in self.names:
+            if nm in cols:
+                res.append(nm)
+                continue
+            hit = [c for c in cols if str(c).lower() == nm.lower()]
+            if len(hit) == 0:
+                raise Exception( f"Column {nm} of expression {self.text} not found" )
+            res.append(hit[0])
+        return res
+
+    def _eval(self, nd, env):
+        if isinstance(nd, ast.BinOp):
+            return OPS[type(nd.op)]( self._eval(nd.left, env), self._eval(nd.right, env) )
+        if isinstance(nd, ast.UnaryOp):
+            return OPS[type(nd.op)]( self._eval(nd.operand, env) )
+        if isinstance(nd, ast.Constant):
+            return nd.value
+        if isinstance(nd, ast.Name):
+            return env[self.quoted.get(nd.id, nd.id)]
+        return FUNCS[nd.func.id]( *[self._eval(a, env) for a in nd.args] )
+
+    ## Series of the expression over frame df named by the expression, reused while its columns hold the same data
+    def eval(self, df):
+        cols = self.columns(df.columns)
+        srcs = [df[c] for c in cols]
+        key = (self.text, len(df), tuple([_buffer(s) for s in srcs]))
+        hit = Expr.cache.get(key)
+        if hit is not None:
+            Expr.cache.move_to_end(key)
+            vals = hit[0]
+        else:
+            env = {nm: s.to_numpy() for nm, s in zip(self.names, srcs)}
+            vals = np.broadcast_to( np.asarray(self._eval(self.tree, env)), (len(df),) )
+            # the sources are kept so their buffers are not reused while the key is cached
+            Expr.cache[key] = (vals, srcs)
+            while len(Expr.cache) > Expr.cacheSize:
+                Expr.cache.popitem(last=False)
+        return pd.Series(vals, index=df.index, name=self.text, copy=False)
@@ -1,18 +1,69 @@
 
-import pandas as pd
 from enum import Enum, auto
 from abc import ABC, abstractmethod
+from collections import OrderedDict
 import gc
+import asyncio
+import importlib
 
 from pure_tech.core.tools import Classes, FileSys
 from pure_tech.core.Config import Config, ENV
 from pure_tech.core.App import App
-from pure_tech.core.Chart import Chart, ChartTypes
-from pure_tech.dal.MarketData import *
 from pure_tech.core.Logger import Logger
 
 logger = Logger(__file__)
 
+# heavy names imported on first use so pages that never chart start quickly, name -> (module, attribute or None for the module)
+_lazy = {'pd':('pandas', None), 'np':('numpy', None),
+         'Chart':('pure_tech.core.Chart', 'Chart'), 'ChartTypes':('pure_tech.core.Chart', 'ChartTypes')}
+
+## Names a star import of a module with globals g gives, its public ones, the lazy ones and those of MarketData
+def exportedNames(g, lazy):
+    md = importlib.import_module('pure_tech.dal.MarketData')
+    mdNames = getattr(md, '__all__', [n for n in dir(md) if not n.startswith('_')])
+    return list( dict.fromkeys([n for n in g if not n.startswith('_')] + list(lazy) + list(mdNames)) )
+
+## Resolve the lazily imported names, then MarketData names that used to come from its star import
+## __all__ lists them all, so a star import still gets every name while a plain import stays light
+def __getattr__(name):
+    if name == '__all__':
+        return exportedNames(globals(), _lazy)
+    if name in _lazy:
+        m = importlib.import_module(_lazy[name][0])
+        return m if _lazy[name][1] is None else getattr(m, _lazy[name][1])
+    if not name.startswith('__'):
+        md = importlib.import_module('pure_tech.dal.MarketData')
+        if hasattr(md, name):
+            return getattr(md, name)
+    raise AttributeError( f"module {__name__} has no attribute {name}" )
+
+# modules that must not be loaded just by importing the GUI modules
+HEAVY_MODULES = ['plotly', 'pandas', 'numpy', 'bqplot', 'ipydatagrid', 'pure_tech.dal.MarketData']
+
+## Import module in a fresh interpreter, raise when it takes over budget seconds or pulls in a heavy module
+def checkStartup(module='pure_tech.core.JupyterWidget', budget=1.0):
+    import subprocess, sys, json
+    code = ( f"import sys,time,json\nst=time.perf_counter()\nimport {module}\n"
+             f"print(json.dumps([time.perf_counter()-st,[m for m in {HEAVY_MODULES!r} if m in sys.modules]]))" )
+    res = subprocess.run( [sys.executable, '-c', code], capture_output=True, text=True )
+    if res.returncode != 0:
+        raise Exception( f"Unable to import {module} {res.stderr}" )
+    took, heavy = json.loads( res.stdout.strip().splitlines()[-1] )
+    logger.info( f"import {module} took {took:.3f}s budget {budget:.3f}s heavy modules loaded {heavy}" )
+    if took > budget or len(heavy) > 0:
+        raise Exception( f"Startup budget exceeded importing {module} {took:.3f}s > {budget:.3f}s or loaded {heavy}" )
+    return took
+
+# worker threads for page data loads and chart assembly, started on first submit
+_pagePool = None
+
+def pagePool(workers=4):
+    global _pagePool
+    if _pagePool is None:
+        from concurrent.futures import ThreadPoolExecutor
+        _pagePool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='page')
+    return _pagePool
+
 class GUIType(Enum):
     
     view = auto()
@@ -45,7 +96,19 @@ class GUI(ABC):
         self.charts = {}
         self.chartColors = {}
         self.chartTypes = {}
+        # chart styles resolved from chartTypes/chartColors, kept while styleVersion is the one they were resolved at
+        self.styleVersion = 0
+        self.styles = (0, {})
+        self.links = {}
         self.dctArgs = dctArgs
+        self.eventDelay = dctArgs['eventDelay'] if dctArgs is not None and 'eventDelay' in dctArgs else 0.25
+        self.pendingEvents = {}
+        self.runningEvents = {}
+        self.tasks = {}
+        self.taskGen = 0
+        self.active = True
+        # called with the page when a cached page is shown again, e.g. to reload stale data
+        self.onActivate = None
     
     @abstractmethod
     def addNewDisp(self, name):
@@ -84,9 +147,42 @@ class GUI(ABC):
                     defVal=cv['defVal'] if 'defVal' in cv else None, oper=cv['oper'] if 'oper' in cv else None)
 
     @abstractmethod
-    def log(self,l,clear=False):
+    def log(self,l,clear=False,level='INFO'):
         pass
 
+    ## Debounced callback for widget id, a burst of changes calls oper once with the latest event after delay seconds
+    ## An async oper still running when a newer event arrives is cancelled
+    ## Without a running event loop (outside a kernel) or with delay 0 oper is called straight away
+    def dispatch(self,id,oper,delay=None):
+        if oper is None:
+            return None
+        delay = self.eventDelay if delay is None else delay
+        def fire(key,ev):
+            self.pendingEvents.pop(key, None)
+            try:
+                res = oper(ev)
+                if asyncio.iscoroutine(res):
+                    self.runningEvents[id] = asyncio.ensure_future(res)
+            except Exception as e:
+                logger.info( f"Event handler for {id} failed {e}" )
+                self.log( f"Event handler for {id} failed {e}", level='ERROR' )
+        def onEvent(ev):
+            prev = self.runningEvents.pop(id, None)
+            if prev is not None and not prev.done():
+                prev.cancel()
+            # coalesce per trait so a later index or label change does not swallow a value change
+            key = (id, ev['name'] if isinstance(ev, dict) and 'name' in ev else None)
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = None
+            if delay <= 0 or loop is None:
+                return oper(ev)
+            if key in self.pendingEvents:
+                self.pendingEvents[key].cancel()
+            self.pendingEvents[key] = loop.call_later(delay, fire, key, ev)
+        return onEvent
+
     def get(self,id):
         if id in self.widgets:
             return self.widgets[id]
@@ -202,11 +298,11 @@ class GUI(ABC):
         pass
 
     @abstractmethod
-    def hBox(self,ids):
+    def hBox(self,ids,path=None):
         pass
 
     @abstractmethod
-    def vBox(self,ids):
+    def vBox(self,ids,path=None):
         pass
 
     def isSimple(jo):
@@ -217,13 +313,25 @@ class GUI(ABC):
         return False
     
     @abstractmethod
-    def setView(self,disps={},top=None):
+    def setView(self,disps={},top=None,path=()):
         pass
 
     @abstractmethod
-    def showGrid(self,id,df):
+    def showGrid(self,id,df,key=None):
         pass
 
+    ## Changed cells between two frames with the same rows, matched on key columns or the index
+    ## returns (rows, columns, values) of new or None when rows or columns differ
+    def gridDelta(old, new, key=None):
+        o = old.set_index(key) if key is not None else old
+        n = new.set_index(key) if key is not None else new
+        if len(o) != len(n) or not o.index.equals(n.index) or not o.columns.equals(n.columns):
+            return None
+        import numpy as np
+        diff = ((o != n) & ~(o.isna() & n.isna())).to_numpy()
+        rows, cols = np.nonzero(diff)
+        return rows, [n.columns[c] for c in cols], [n.iat[r,c] for r, c in zip(rows, cols)]
+
     @abstractmethod
     def showLink(self,id,link,linkTitle):
         pass
@@ -236,6 +344,7 @@ class GUI(ABC):
         self.chartTypes[fld] = [typ]
         if mode is not None:
             self.chartTypes[fld] = [typ, mode, symbol, color, width]
+        self.styleVersion += 1
 
     def clearCharts(self):
         del self.charts
@@ -255,15 +364,129 @@ class GUI(ABC):
         pass
 
     def addChart(self,id,df,x,y1,y2, ch=None, row=1, col=1, desc=None,x1T=None,y1T=None,y2T=None,legendGroup=None):
+        from pure_tech.core.Chart import Chart
         if ch is None and id not in self.charts:
             ch = Chart()
             self.charts[id] = ch
         elif id in self.charts and ch is None:
             ch = self.charts[id]
+        if self.styles[0] != self.styleVersion:
+            self.styles = (self.styleVersion, {})
         ch.plot(df, x, y1, y2, y1Type=self.chartTypes, y2Type=self.chartTypes, title=desc, row=row, col=col, xT=x1T, y1T=y1T, y2T=y2T,
-            showLegend=True, colors=self.chartColors, legendGroup=legendGroup)
+            showLegend=True, colors=self.chartColors, legendGroup=legendGroup, styles=self.styles[1])
         return ch
 
+    ## Switch the Candle/OHLC traces of chart id to timeframe tf, bars come from the cache of each series
+    def setTimeframe(self,id,tf):
+        if id not in self.charts:
+            raise Exception( f"Error chart {id} not found" )
+        return self.charts[id].setTimeframe(tf)
+
+    ## Link charts ids plotted from frame df under key, selections on the key cols filter their traces in place
+    ## With source and on, zooming chart source selects its x range on column on for the other linked charts
+    def linkCharts(self,key,df,ids,cols,source=None,on=None):
+        from pure_tech.core.CrossFilter import CrossFilter
+        self.links[key] = {'cf':CrossFilter(df, cols), 'ids':list(ids), 'crit':{}}
+        if source is not None and on is not None:
+            if source not in self.charts:
+                raise Exception( f"Error chart {source} not found" )
+            oper = self.dispatch(key, lambda rng: self.crossFilter(key, exclude=[source], **{on:None if rng is None else tuple(rng)}))
+            self.charts[source].onRange(oper)
+
+    ## Change the selection of link key, a column set to None is no longer filtered, returns the selected rows
+    def crossFilter(self,key,exclude=[],**crit):
+        if key not in self.links:
+            raise Exception( f"No linked charts {key}" )
+        lk = self.links[key]
+        lk['crit'].update(crit)
+        lk['crit'] = {c:v for c, v in lk['crit'].items() if v is not None}
+        rows = lk['cf'].select(**lk['crit'])
+        for id in lk['ids']:
+            if id in self.charts and id not in exclude:
+                self.charts[id].filter(lk['cf'].df, rows)
+        return rows
+
+    def unlinkCharts(self,key):
+        self.links.pop(key, None)
+
+    ## Show a loading placeholder in view id until its content arrives
+    @abstractmethod
+    def loading(self,id,msg='Loading...'):
+        pass
+
+    ## Run fn() on the page worker threads and then(result) back on the kernel loop
+    ## A newer submit for the same id or cancelTasks drops the result, without a running loop fn runs inline
+    def submit(self,id,fn,then=None):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None:
+            res = fn()
+            return then(res) if then is not None else res
+        if id in self.tasks:
+            self.tasks[id].cancel()
+        gen = self.taskGen
+        ft = pagePool().submit(fn)
+        self.tasks[id] = ft
+        ft.add_done_callback(lambda f: None if f.cancelled() or gen != self.taskGen else
+                             loop.call_soon_threadsafe(self._deliver, id, f, then, gen))
+        return ft
+
+    def _deliver(self,id,ft,then,gen):
+        if gen != self.taskGen or self.tasks.get(id) is not ft:
+            return
+        del self.tasks[id]
+        if ft.exception() is not None:
+            self.log( f"Loading {id} failed {ft.exception()}", level='ERROR' )
+            return
+        if then is not None:
+            then(ft.result())
+
+    ## Cancel all loads of this page, results still in flight are dropped, returns how many were cancelled
+    def cancelTasks(self):
+        self.taskGen += 1
+        n = len(self.tasks)
+        for ft in self.tasks.values():
+            ft.cancel()
+        self.tasks = {}
+        return n
+
+    ## Release a page dropped from the page cache, toolkits close their widgets so they can be freed
+    def close(self):
+        self.cancelTasks()
+        self.clearCharts()
+        self.links = {}
+        self.widgets = {}
+
+    ## Show a page again from its existing widgets
+    @abstractmethod
+    def activate(self):
+        pass
+
+    ## Rough bytes of data held by the page, used for the page cache budget
+    def memSize(self):
+        n = 0
+        for ch in self.charts.values():
+            for src in ch.fullData:
+                if src is not None:
+                    n += sum( [getattr(a, 'nbytes', 0) for a in src] )
+            if ch.fig is not None:
+                for tr in ch.fig.data:
+                    n += sum( [getattr(getattr(tr, k, None), 'nbytes', 0) for k in ['x','y']] )
+        return n
+
+    ## plotChart with final run on the page worker threads, node shows a placeholder meanwhile
+    def plotChartAsync(self,id,node,desc=None,sharedX=False,sharedY=False,width=None,height=None,props=None):
+        if node not in self.widgets:
+            raise Exception( f"chart cannot be placed in widget {node} doesn't exist" )
+        if id not in self.charts:
+            raise Exception( f"Error chart {id} not found" )
+        ch = self.charts[id]
+        self.loading(node)
+        return self.submit(node, lambda: ch.final(desc, w=width, h=height,sharedX=sharedX,sharedY=sharedY,props=props),
+            then=lambda fig: self._displayChart(node, self.widgets[node], ch) if node in self.widgets else None)
+
     def plotChart(self,id,node,desc=None,sharedX=False,sharedY=False,width=None,height=None,props=None):
         #print( self.charts )
         if node not in self.widgets:
@@ -289,6 +512,22 @@ gOldGUI = None
 topMenus = None
 topMenuKeys = []
 pDisp = None
+# built pages by (topMenu, subMenu), least recently shown first
+pageCache = OrderedDict()
+
+## Drop least recently shown pages beyond UI.pageCacheSize pages or UI.pageCacheBytes of data, never the current one
+def evictPages(maxPages, maxBytes=None):
+    while len(pageCache) > 1:
+        over = len(pageCache) > maxPages
+        if not over and maxBytes is not None:
+            over = sum( [p.memSize() for p in pageCache.values()] ) > maxBytes
+        if not over:
+            break
+        key, old = pageCache.popitem(last=False)
+        print( f'Evicting cached page {key}' )
+        old.close()
+        del old
+        gc.collect()
 
 def onClickSubMenu(topMenu, subMenu,*args):
     global topUI
@@ -299,17 +538,37 @@ def onClickSubMenu(topMenu, subMenu,*args):
     if gPrevTop != (topMenu, subMenu):
         tm = topMenu
         lv = topMenus[tm][subMenu]
+        maxPages = Config.get("UI.pageCacheSize")
+        maxPages = int(maxPages) if maxPages is not None else 5
+        maxBytes = Config.get("UI.pageCacheBytes")
+        maxBytes = int(maxBytes) if maxBytes is not None else None
         if pageUI is not None:
-            del pageUI
+            # drop loads still running for the page being left, a half loaded page is not kept
+            if pageUI.cancelTasks() > 0 or maxPages <= 0:
+                pageCache.pop(gPrevTop, None)
+                pageUI.close()
+                del pageUI
+                print( 'Deleting old GUI object' )
+                gc.collect()
+            else:
+                pageUI.active = False
             pageUI = None
-            print( 'Deleting old GUI object' )
-            gc.collect()
-        mode = Config.get("UI.type")
-        pageUI  = Classes.getObject( mode, superClass=GUI, objKey=None, name=f"{topMenu}.{subMenu}", dctArgs={'disp':pDisp} )
-        pageUI.setupLogger()
-        print( f"{mode=} {topMenu=}.{subMenu=} {pageUI} module=[{lv['module']}.{lv['function']}]" )
-        pageUI = Classes.callFunc( f"{lv['module']}.{lv['function']}", pageUI )
-        gPrevTop = (topMenu, subMenu)
+        key = (topMenu, subMenu)
+        if key in pageCache:
+            pageCache.move_to_end(key)
+            pageUI = pageCache[key]
+            print( f"Restoring cached page {topMenu}.{subMenu}" )
+            pageUI.activate()
+        else:
+            mode = Config.get("UI.type")
+            pageUI  = Classes.getObject( mode, superClass=GUI, objKey=None, name=f"{topMenu}.{subMenu}", dctArgs={'disp':pDisp} )
+            pageUI.setupLogger()
+            print( f"{mode=} {topMenu=}.{subMenu=} {pageUI} module=[{lv['module']}.{lv['function']}]" )
+            pageUI = Classes.callFunc( f"{lv['module']}.{lv['function']}", pageUI )
+            if maxPages > 0:
+                pageCache[key] = pageUI
+                evictPages(maxPages, maxBytes)
+        gPrevTop = key
 
 def onSubMenu(*args):
     lo=args[0]
@@ -360,4 +619,5 @@ def runMenu():
         Config.loadConnections(App.env)
         App.start(genMainMenu)
 
-
+if __name__=='__main__':
+    checkStartup()
@@ -2,25 +2,52 @@ from ipywidgets import interact, HBox, VBox, Output, HTML, Layout, widgets
 from IPython.display import Javascript, FileLink, FileLinks
 
 from pure_tech.core.Logger import WidgetLog
-from pure_tech.core.Chart import Chart, ChartTypes
-import pandas as pd
-
-from bqplot import LinearScale, ColorScale
-from ipydatagrid import DataGrid, BarRenderer
+import threading
+import importlib
+import html
+from collections import deque
 
 from IPython.display import display, clear_output
-import plotly.offline as pyo
-import plotly.graph_objs as go
-# Set notebook mode to work in offline
-pyo.init_notebook_mode()
 
 from pure_tech.core.Config import Config, ENV
-from pure_tech.dal.MarketData import *
 from ipywidgets import Box
 
 from enum import Enum, auto
 
-from pure_tech.core.GUI import *
+# not a star import, that would resolve the lazy names of GUI, its other names are reached through __getattr__
+from pure_tech.core.GUI import GUI, logger, exportedNames
+
+# heavy names imported on first use instead of at import, name -> (module, attribute or None for the module)
+_lazy = {'DataGrid':('ipydatagrid', 'DataGrid'), 'BarRenderer':('ipydatagrid', 'BarRenderer'),
+         'LinearScale':('bqplot', 'LinearScale'), 'ColorScale':('bqplot', 'ColorScale'),
+         'pyo':('plotly.offline', None), 'go':('plotly.graph_objs', None),
+         'Chart':('pure_tech.core.Chart', 'Chart'), 'ChartTypes':('pure_tech.core.Chart', 'ChartTypes')}
+
+## Resolve the lazily imported names, then the names that used to come from the star import of GUI
+## __all__ lists them all, so a star import still gets every name while a plain import stays light
+def __getattr__(name):
+    gm = importlib.import_module('pure_tech.core.GUI')
+    if name == '__all__':
+        return list( dict.fromkeys(exportedNames(globals(), _lazy) + gm.__all__) )
+    if name in _lazy:
+        m = importlib.import_module(_lazy[name][0])
+        return m if _lazy[name][1] is None else getattr(m, _lazy[name][1])
+    if not name.startswith('__') and hasattr(gm, name):
+        return getattr(gm, name)
+    raise AttributeError( f"module {__name__} has no attribute {name}" )
+
+# log levels, lines below the widget's logLevel are not kept
+LOG_LEVELS = {'DEBUG':10, 'INFO':20, 'WARNING':30, 'ERROR':40}
+
+_notebookMode = False
+
+## Set notebook mode to work in offline, done once when the first chart is shown
+def initNotebookMode():
+    global _notebookMode
+    if not _notebookMode:
+        import plotly.offline as pyo
+        pyo.init_notebook_mode()
+        _notebookMode = True
 
 class JupyterWidget(GUI):
     
@@ -29,6 +56,29 @@ class JupyterWidget(GUI):
         disp = dctArgs['disp'] if dctArgs is not None and 'disp' in dctArgs else None
         self.hDisp = display(display_id=self.name) if disp is None else disp
         self.supportingDisp = None
+        self.figWidgets = {}
+        # per view, the box the page selectors of its chart go in
+        self.pagers = {}
+        self.grids = {}
+        self.gridChunk = 5000
+        self.gridDelay = 0.2
+        self.placeholders = set()
+        self.root = None
+        self.mounted = {}
+        self.seenPaths = set()
+        # log lines are kept in a ring buffer and rendered in batches into one HTML widget
+        arg = lambda k, d: dctArgs[k] if dctArgs is not None and k in dctArgs else d
+        self.logLines = deque(maxlen=arg('logCapacity', 2000))
+        self.logLevel = arg('logLevel', 'DEBUG')
+        self.logWindow = arg('logWindow', 200)
+        self.logBatch = 100
+        self.logDelay = 0.5
+        self.logPending = 0
+        self.logDropped = 0
+        self.logTimer = None
+        self.logView = None
+        self.logOut = None
+        self.logLock = threading.Lock()
     
     def addNewDisp(self, name):
         self.supportingDisp = display(display_id=name)
@@ -38,19 +88,93 @@ class JupyterWidget(GUI):
         self.view('log')
 
     def __del__(self):
-        self.log( f'clearing out GUI loaders {self.name}' )
-        with self.hDisp:
-            clear_output()
-
-    def log(self,l,clear=False):
+        # the log view goes with the widget, a pending flush timer must not outlive it
+        if self.logTimer is not None:
+            self.logTimer.cancel()
+        # module globals are already gone when this runs at interpreter shutdown
+        if logger is not None:
+            logger.info( f'clearing out GUI loaders {self.name}' )
+        # a cached page dropped while another page uses the shared display must not clear it
+        if self.active:
+            with self.hDisp:
+                clear_output()
+
+    def activate(self):
+        self.active = True
+        if self.root is not None:
+            self.hDisp.update(self.root)
+        if self.onActivate is not None:
+            self.onActivate(self)
+
+    def memSize(self):
+        return super().memSize() + sum( [int(gv['df'].memory_usage().sum()) for gv in self.grids.values()] )
+
+    ## Lines are buffered and flushed after logDelay seconds or logBatch lines, only the last logWindow are shown
+    def log(self,l,clear=False,level='INFO'):
         o3 = self.widgets['log'] if 'log' in self.widgets else None
         if o3 is None:
             #print(l)
             return
-        with o3:
-            if clear:
-                o3.clear_output()
-            display(l)
+        if clear:
+            with self.logLock:
+                self.logLines.clear()
+                self.logPending = 0
+                self.logDropped = 0
+                self.logView = None
+            o3.outputs = ()
+        if LOG_LEVELS.get(level, 20) < LOG_LEVELS.get(self.logLevel, 10):
+            return
+        if not isinstance(l, str):
+            # frames, html and other rich objects are displayed as before, after the lines logged ahead of them
+            if self.logPending > 0:
+                self.flushLog()
+            with self.logLock:
+                self.logLines.clear()
+                self.logDropped = 0
+                self.logView = None
+            o3.append_display_data(l)
+            return
+        if self.logView is None or self.logOut is not o3:
+            # made here rather than in a timer flush, append_display_data does not depend on the calling thread's cell
+            self.logView, self.logOut = HTML(), o3
+            o3.append_display_data(self.logView)
+        with self.logLock:
+            if len(self.logLines) == self.logLines.maxlen and self.logPending == len(self.logLines):
+                # the oldest line leaves the buffer before it was ever rendered
+                self.logDropped += 1
+                self.logPending -= 1
+            self.logLines.append( (level, l) )
+            self.logPending += 1
+            flushNow = self.logPending >= self.logBatch
+            if not flushNow and self.logTimer is None:
+                self.logTimer = threading.Timer(self.logDelay, self.flushLog)
+                self.logTimer.daemon = True
+                self.logTimer.start()
+        if flushNow:
+            self.flushLog()
+
+    def setLogLevel(self,level):
+        if level not in LOG_LEVELS:
+            raise Exception( f"Unknown log level {level}" )
+        self.logLevel = level
+
+    ## Render the most recent logWindow lines in one update of the log view
+    def flushLog(self):
+        with self.logLock:
+            if self.logTimer is not None:
+                self.logTimer.cancel()
+                self.logTimer = None
+            if self.logPending == 0:
+                return
+            self.logPending = 0
+            lines = list(self.logLines)[-self.logWindow:]
+            dropped = self.logDropped
+        view = self.logView
+        if view is None or self.logOut is not self.widgets.get('log'):
+            return
+        head = f"<i>{dropped} lines dropped</i>\n" if dropped > 0 else ""
+        body = "\n".join( [ (f"[{lv}] " if lv != 'INFO' else "") + html.escape(t) for lv, t in lines ] )
+        view.value = f"<pre style='margin:0'>{head}{body}</pre>"
 
     def _showWidget(self,id,widget_,show=True):
         _widget.layout.visibility = 'visible' if show else 'hidden'
@@ -115,13 +239,13 @@ class JupyterWidget(GUI):
         self.widgets[id] = wv
         wv.selected_index=None
         if oper is not None:
-            wv.observe(oper,'value')
+            wv.observe(self.dispatch(id,oper),'value')
         return wv
 
     def checkbox(self,id,desc,defVal=False,oper=None):
         wv = widgets.Checkbox(value=defVal, description=desc,disabled=False)
         if oper is not None:
-            wv.observe(oper,'value')
+            wv.observe(self.dispatch(id,oper),'value')
         self.widgets[id] = wv
         return wv
 
@@ -129,7 +253,7 @@ class JupyterWidget(GUI):
         wv = widgets.DatePicker(description=desc,disabled=False,value=defVal)
         wv.add_class('dateMinMaxSet')
         if oper is not None:
-            wv.observe(oper,'value')
+            wv.observe(self.dispatch(id,oper),'value')
         self.widgets[id] = wv
 
     def view(self,id):
@@ -140,14 +264,14 @@ class JupyterWidget(GUI):
     def select(self,id,desc,options=[],defVal=None,oper=None):
         wv = widgets.Select(options=options,description=desc,disabled=False,value=defVal)
         if oper is not None:
-            wv.observe(oper)
+            wv.observe(self.dispatch(id,oper))
         self.widgets[id]=wv
         return wv
 
     def selMulti(self,id,desc,options=[],defVal=[],oper=None):
         wv = widgets.SelectMultiple(options=options,description=desc,disabled=False,value=defVal)
         if oper is not None:
-            wv.observe(oper)
+            wv.observe(self.dispatch(id,oper))
         self.widgets[id]=wv
         return wv
 
@@ -172,9 +296,16 @@ class JupyterWidget(GUI):
             self.disps = disps
         else:
             disps = self.disps
+        self.seenPaths = set()
         x=self.setView(disps)
-        self.hDisp.update(script)
-        self.hDisp.update(x)
+        # containers no longer in the layout are forgotten, the widgets inside stay in self.widgets
+        for path in [p for p in self.mounted if p not in self.seenPaths]:
+            del self.mounted[path]
+        # a reused root updates in place, only a new root goes to the display
+        if x is not self.root:
+            self.root = x
+            self.hDisp.update(script)
+            self.hDisp.update(x)
 
     def clearSelected(self,id):
         wv = self.widgets[id]
@@ -183,41 +314,114 @@ class JupyterWidget(GUI):
         else:
             wv.value = None
 
-    def hBox(self,ids):
-        return HBox([self.widgets[i] for i in ids if i in self.widgets])
+    def hBox(self,ids,path=None):
+        children = [self.widgets[i] for i in ids if i in self.widgets]
+        return HBox(children) if path is None else self._mount(path,HBox,children)
+
+    def vBox(self,ids,path=None):
+        children = [self.widgets[i] for i in ids if i in self.widgets]
+        return VBox(children) if path is None else self._mount(path,VBox,children)
+
+    ## Reuse the container mounted at path when it has the same class, children are only set when they changed
+    def _mount(self,path,cls,children):
+        self.seenPaths.add(path)
+        wv = self.mounted.get(path)
+        if type(wv) is not cls:
+            wv = cls(children=children)
+            self.mounted[path] = wv
+        elif len(wv.children)!=len(children) or any([a is not b for a,b in zip(wv.children,children)]):
+            wv.children = children
+        return wv
 
-    def vBox(self,ids):
-        return VBox([self.widgets[i] for i in ids if i in self.widgets])
+    ## Tabs are created once, a later refresh updates the children and titles of the existing one
+    def _mountTab(self,id,children):
+        wv = self.widgets.get(id)
+        if type(wv) is not widgets.Tab:
+            return self.tab(id,children)
+        chs = [self.widgets[children[i]] for i in children.keys()]
+        if len(wv.children)!=len(chs) or any([a is not b for a,b in zip(wv.children,chs)]):
+            wv.children = chs
+        if list(wv.titles)!=list(children.keys()):
+            wv.titles = list(children.keys())
+        return wv
 
-    def setView(self,disps={},top=None):
+    ## Layout paths identify containers across refreshes so unchanged parts of the tree are kept
+    def setView(self,disps={},top=None,path=()):
         hs = []
         vs = []
         tlv = 'v.>>' if top is None else top
         for lv in disps:
             dvs = disps[lv]
             if lv.startswith('tab.'):
-                hs.append(self.tab(lv,dvs))
+                hs.append(self._mountTab(lv,dvs))
             elif GUI.isSimple(dvs):
                 if tlv.startswith('h.'):
-                    hs.append(self.hBox(dvs) if lv.startswith('h.') else self.vBox(dvs))
+                    hs.append(self.hBox(dvs,path+(lv,)) if lv.startswith('h.') else self.vBox(dvs,path+(lv,)))
                 else:
-                    vs.append(self.hBox(dvs) if lv.startswith('h.') else self.vBox(dvs))
+                    vs.append(self.hBox(dvs,path+(lv,)) if lv.startswith('h.') else self.vBox(dvs,path+(lv,)))
             else:
                 if tlv.startswith('h.'):
-                    hs.append(self.setView(dvs,top=lv))
+                    hs.append(self.setView(dvs,top=lv,path=path+(lv,)))
                 else:
-                    vs.append(self.setView(dvs,top=lv))
+                    vs.append(self.setView(dvs,top=lv,path=path+(lv,)))
         if len(vs)>0 and len(hs)>0:
-            return Box(children=[HBox(hs),VBox(vs)])
+            return self._mount(path,Box,[self._mount(path+('h',),HBox,hs),self._mount(path+('v',),VBox,vs)])
         elif len(vs)>0:
-            return VBox(vs)
+            return self._mount(path,VBox,vs)
         else:
-            return HBox(hs)
+            return self._mount(path,HBox,hs)
 
-    def showGrid(self,id,df):
-        if id in self.widgets:
+    ## One DataGrid per view, later frames with the same rows are sent as changed cells only
+    ## key names the column(s) matching rows, the index otherwise. Big frames load in growing chunks
+    def showGrid(self,id,df,key=None):
+        if id not in self.widgets:
+            return
+        gv = self.grids.get(id)
+        if gv is None:
+            from ipydatagrid import DataGrid
+            gv = {'df':df, 'shown':min(len(df), self.gridChunk), 'timer':None}
+            gv['grid'] = DataGrid(df.iloc[:gv['shown']], editable=False)
+            self._clearLoading(id)
+            self.grids[id] = gv
             with self.widgets[id]:
-                display( DataGrid(df, editable=False) )
+                display( gv['grid'] )
+            self._loadGrid(id)
+            return
+        old, gv['df'] = gv['df'], df
+        if gv['shown'] < len(old):
+            # still loading, the next chunk is cut from the new frame
+            return
+        cells = GUI.gridDelta(old, df, key)
+        if cells is None or len(cells[0]) > self.gridChunk:
+            # rows were inserted or deleted, DataGrid can only take the whole frame
+            gv['grid'].data = df
+            gv['shown'] = len(df)
+            return
+        rows, cols, vals = cells
+        for r, c, v in zip(rows, cols, vals):
+            gv['grid'].set_cell_value_by_index(c, int(r), v.item() if hasattr(v, 'item') else v)
+
+    ## Grow the rows shown in grid id, doubling each step so the total sent stays under twice the frame
+    def _loadGrid(self,id):
+        gv = self.grids.get(id)
+        if gv is None or gv['shown'] >= len(gv['df']):
+            return
+        def step():
+            if self.grids.get(id) is not gv:
+                return
+            gv['shown'] = min(2*gv['shown'], len(gv['df']))
+            gv['grid'].data = gv['df'].iloc[:gv['shown']]
+            self._loadGrid(id)
+        gv['timer'] = threading.Timer(self.gridDelay, step)
+        gv['timer'].daemon = True
+        gv['timer'].start()
+
+    def _closeGrid(self,id):
+        gv = self.grids.pop(id, None)
+        if gv is not None:
+            if gv['timer'] is not None:
+                gv['timer'].cancel()
+            gv['grid'].close()
 
     def showLink(self,id,link,linkTitle):
         if id in self.widgets:
@@ -225,9 +429,112 @@ class JupyterWidget(GUI):
                 display( f"Download: {linkTitle}" )
                 display( FileLink(link) )
 
+    ## Placeholder shown until a chart or grid arrives, a view already showing one keeps it meanwhile
+    def loading(self,id,msg='Loading...'):
+        if id not in self.widgets or id in self.figWidgets or id in self.grids:
+            return
+        wv = self.widgets[id]
+        wv.clear_output()
+        with wv:
+            display( HTML(f"<i>{msg}</i>") )
+        self.placeholders.add(id)
+
+    def _clearLoading(self,id):
+        if id in self.placeholders:
+            self.placeholders.discard(id)
+            self.widgets[id].clear_output()
+
+    ## Close the FigureWidget shown in view id so its model is released in the kernel
+    def _closeFigure(self,id):
+        if id in self.figWidgets:
+            fw, ch = self.figWidgets.pop(id)
+            ch.detach(fw)
+            fw.close()
+        if id in self.pagers:
+            self._closeWidget(self.pagers.pop(id))
+
+    def clearView(self,id):
+        self._closeFigure(id)
+        self._closeGrid(id)
+        self.placeholders.discard(id)
+        super().clearView(id)
+
+    def clearChart(self,id):
+        if id in self.charts:
+            for node in [n for n in self.figWidgets if self.figWidgets[n][1] is self.charts[id]]:
+                self._closeFigure(node)
+        super().clearChart(id)
+
+    def clearCharts(self):
+        for node in list(self.figWidgets.keys()):
+            self._closeFigure(node)
+        super().clearCharts()
+
+    ## ipywidgets keeps every widget until it is closed, so a dropped page closes all of its own
+    def close(self):
+        if self.logTimer is not None:
+            self.logTimer.cancel()
+            self.logTimer = None
+        for id in list(self.grids.keys()):
+            self._closeGrid(id)
+        owned = list(self.widgets.values()) + list(self.mounted.values())
+        owned += [self.logView] if self.logView is not None else []
+        super().close()
+        for wv in owned:
+            if isinstance(wv, widgets.Widget):
+                self._closeWidget(wv)
+        self.mounted = {}
+        self.logView = None
+        self.placeholders = set()
+        self.root = None
+
+    ## Close widget wv and the widgets in it, layout and style are widgets of their own
+    def _closeWidget(self,wv):
+        for sub in list(getattr(wv, 'children', [])) + [getattr(wv, 'layout', None), getattr(wv, 'style', None)]:
+            if isinstance(sub, widgets.Widget):
+                self._closeWidget(sub)
+        wv.close()
+
+    ## One FigureWidget per view, later charts are diffed into it in place
     def _displayChart(self,id,widget_,chartG_):
+        initNotebookMode()
+        if id in self.figWidgets:
+            fw, ch = self.figWidgets[id]
+            if ch is not chartG_:
+                ch.detach(fw)
+            if chartG_.syncWidget(fw):
+                self.figWidgets[id] = (fw, chartG_)
+                self._showPagers(id, chartG_)
+                return
+            self._closeFigure(id)
+            widget_.clear_output()
+        self._clearLoading(id)
+        fw = chartG_.widget()
+        self.figWidgets[id] = (fw, chartG_)
+        self.pagers[id] = VBox()
         with widget_:
-            display(go.FigureWidget(chartG_.fig.to_dict()).show())
+            display(fw)
+            display(self.pagers[id])
+        self._showPagers(id, chartG_)
+
+    ## Rebuild the page selectors of view id, tables and their page counts change with the chart
+    def _showPagers(self,id,chartG_):
+        box = self.pagers[id]
+        old = box.children
+        box.children = [self._pagers(chartG_)] if len(chartG_.pages) > 0 else []
+        for wv in old:
+            self._closeWidget(wv)
+
+    ## Page selectors for the paged tables of a chart, pages are fetched from the chart on change
+    def _pagers(self,chartG_):
+        ctls = []
+        for (r,c) in chartG_.pages:
+            pg = chartG_.pages[(r,c)]
+            wv = widgets.BoundedIntText(value=pg['page'], min=0, max=chartG_.pageCount(r,c)-1,
+                description=f"Page {r}.{c}", layout=Layout(width='160px'))
+            wv.observe(lambda ch, r=r, c=c: chartG_.page(r, c, ch['new']), 'value')
+            ctls += [wv, widgets.Label(f"of {chartG_.pageCount(r,c)} ({len(pg['df'])} rows)")]
+        return HBox(ctls)
 
 
 
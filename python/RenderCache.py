@@ -0,0 +1,88 @@
+"""
+Content addressed cache of rendered chart images on local disk
+
+Images are stored under the sha256 of the figure json and export options, other files in the folder are never touched
+Least recently used images are evicted once the cache goes over its size budget
+hits, misses and evictions are counted for monitoring
+"""
+import os
+import shutil
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+from pure_tech.core.Logger import Logger
+logger = Logger(__file__)
+
+# names of cached images, anything else in the folder is not the cache's to evict
+KEY_NAME = re.compile(r'[0-9a-f]{64}')
+
+class RenderCache:
+
+    def __init__(self, path, maxBytes=512*1024*1024):
+        self.path = path
+        self.maxBytes = maxBytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        self.entries = OrderedDict()
+        os.makedirs(path, exist_ok=True)
+        # reload the images on disk, oldest access first, other files in path are left alone
+        fls = [os.path.join(path, f) for f in os.listdir(path) if KEY_NAME.fullmatch(f)]
+        for f in sorted([f for f in fls if os.path.isfile(f)], key=os.path.getmtime):
+            self.entries[os.path.basename(f)] = os.path.getsize(f)
+            self.size += self.entries[os.path.basename(f)]
+        self._evict()
+
+    ## Cache key for a figure spec and its export options
+    def key(self, spec, *opts):
+        h = hashlib.sha256(spec.encode('utf-8') if isinstance(spec, str) else spec)
+        for o in opts:
+            h.update(f"|{o}".encode('utf-8'))
+        return h.hexdigest()
+
+    ## Copy the cached image for key to fn, False on a miss
+    def get(self, key, fn):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return False
+            src = os.path.join(self.path, key)
+            try:
+                shutil.copyfile(src, fn)
+            except FileNotFoundError:
+                self.size -= self.entries.pop(key)
+                self.misses += 1
+                return False
+            os.utime(src)
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True
+
+    ## Store the rendered image fn under key
+    def put(self, key, fn):
+        with self.lock:
+            dst = os.path.join(self.path, key)
+            shutil.copyfile(fn, dst)
+            if key in self.entries:
+                self.size -= self.entries.pop(key)
+            self.entries[key] = os.path.getsize(dst)
+            self.size += self.entries[key]
+            self._evict()
+
+    def _evict(self):
+        while self.size > self.maxBytes and len(self.entries) > 0:
+            key, sz = self.entries.popitem(last=False)
+            self.size -= sz
+            self.evictions += 1
+            try:
+                os.remove(os.path.join(self.path, key))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        return {'hits':self.hits, 'misses':self.misses, 'evictions':self.evictions,
+                'entries':len(self.entries), 'bytes':self.size}
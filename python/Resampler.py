@@ -0,0 +1,91 @@
+"""
+Resampler keeps downsampled chart traces at screen resolution while zooming
+
+Attach to a FigureWidget with the full resolution source of each trace
+On every x axis range change the visible window is found with a binary search on the sorted x
+and only that window, downsampled to the screen width, is pushed back in one batch_update
+"""
+import numpy as np
+import pandas as pd
+
+from pure_tech.core.Chart import DOWNSAMPLERS, _numeric
+from pure_tech.core.Logger import Logger
+logger = Logger(__file__)
+
+## Slice or index a Series or array alike
+def _take(a, idx):
+    return a.iloc[idx] if isinstance(a, pd.Series) else np.asarray(a)[idx]
+
+## tz aware datetimes as the naive wall clock times plotly shows, anything else as is
+def _wallClock(x):
+    if isinstance(x, (pd.Series, pd.Index)) and isinstance(x.dtype, pd.DatetimeTZDtype):
+        return pd.DatetimeIndex(x).tz_localize(None)
+    return x
+
+class Resampler:
+
+    ## fw is the FigureWidget, sources is a list parallel to fw.data with (x,y) full data or None
+    ## listen=False leaves the axis range callbacks to the caller, which then calls update
+    def __init__(self, fw, sources, method='minmax', width=None, pxPoints=2, listen=True):
+        self.fw = fw
+        self.listen = listen
+        self.method = method
+        self.width = width
+        self.pxPoints = pxPoints
+        self.series = {}
+        self.axes = {}
+        for i, src in enumerate(sources):
+            if src is not None:
+                self.source(i, src[0], src[1])
+
+    ## Full resolution x,y of trace i, replaces what it had, e.g. after a cross filter
+    def source(self, i, x, y):
+        # plotly sends ranges of tz aware axes as wall clock times, so those are searched on wall clock ns
+        xn = _numeric( _wallClock(x) )
+        if len(xn) > 1 and (np.diff(xn) < 0).any():
+            o = np.argsort(xn, kind='stable')
+            xn, x, y = xn[o], _take(x, o), _take(y, o)
+        isDate = pd.api.types.is_datetime64_any_dtype(x) if isinstance(x, pd.Series) else np.issubdtype(np.asarray(x).dtype, np.datetime64)
+        self.series[i] = (xn, x, y, isDate)
+        ax = 'xaxis' + (self.fw.data[i].xaxis or 'x')[1:]
+        if ax not in self.axes:
+            self.axes[ax] = []
+            if self.listen:
+                self.fw.layout[ax].on_change(lambda o, rng, auto, ax=ax: self.update(ax, None if auto else rng), 'range', 'autorange')
+        if i not in self.axes[ax]:
+            self.axes[ax].append(i)
+
+    ## Stop resampling trace i, e.g. once it is streamed into
+    def drop(self, i):
+        if i in self.series:
+            del self.series[i]
+            for ax in self.axes:
+                if i in self.axes[ax]:
+                    self.axes[ax].remove(i)
+
+    ## Number of points to send for one trace
+    def points(self):
+        w = self.width or self.fw.layout.width or 1000
+        return int(w * self.pxPoints)
+
+    def _toNum(self, v, isDate):
+        return float(pd.Timestamp(v).value) if isDate else float(v)
+
+    ## Re-slice all traces on axis ax to the visible range rng, None for full range
+    def update(self, ax, rng=None):
+        if ax not in self.axes:
+            return
+        n = self.points()
+        with self.fw.batch_update():
+            for i in self.axes[ax]:
+                xn, x, y, isDate = self.series[i]
+                s, e = 0, len(xn)
+                if rng is not None and rng[0] is not None and rng[1] is not None:
+                    s = max( int(np.searchsorted(xn, self._toNum(rng[0], isDate), 'left'))-1, 0 )
+                    e = min( int(np.searchsorted(xn, self._toNum(rng[1], isDate), 'right'))+1, len(xn) )
+                xs, ys = _take(x, slice(s, e)), _take(y, slice(s, e))
+                if e-s > n:
+                    idx = DOWNSAMPLERS[self.method](xs, ys, n)
+                    xs, ys = _take(xs, idx), _take(ys, idx)
+                self.fw.data[i].x = xs
+                self.fw.data[i].y = ys
@@ -0,0 +1,41 @@
+"""
+Fixed size ring buffer on a NumPy array
+
+Values are written twice, at i and i+size, so the last count values are always one contiguous view
+Used by Chart.append to keep a bounded window of streamed points per trace
+"""
+import numpy as np
+
+class RingBuffer:
+
+    def __init__(self, size, dtype=np.float64):
+        self.size = size
+        self.buf = np.empty(2*size, dtype=dtype)
+        self.start = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    ## Append values, only the last size values are kept
+    def extend(self, vals):
+        v = np.asarray(vals, dtype=self.buf.dtype).ravel()
+        if len(v) >= self.size:
+            v = v[-self.size:]
+        pos = (self.start + self.count + np.arange(len(v))) % self.size
+        self.buf[pos] = v
+        self.buf[pos+self.size] = v
+        self.count += len(v)
+        if self.count > self.size:
+            self.start = (self.start + self.count - self.size) % self.size
+            self.count = self.size
+
+    ## Drop the n oldest values
+    def drop(self, n):
+        n = min(n, self.count)
+        self.start = (self.start + n) % self.size
+        self.count -= n
+
+    ## Contiguous view of the values oldest first, no copy
+    def view(self):
+        return self.buf[self.start:self.start+self.count]